@@ -0,0 +1,337 @@
+"""
+离线压测工具：合成题目图片语料、生成/回放请求日志，按并发梯度统计 p50/p95/p99 和吞吐
+
+    python bench.py corpus --n 50                      # 生成 bench_corpus/ 下的 png/jpg
+    python bench.py fill --n 200                       # 按语料生成 requests.jsonl
+    python bench.py replay --spawn --concurrency 1,4,16 --requests 200
+    python bench.py tags --n 20000                     # 知识点打标：题库引擎 vs 旧 if/elif
+
+replay 读取的日志格式与服务端 REQUEST_LOG 写出的相同，线上录到的日志可以直接回放。
+--spawn 会在本地拉起 deepseek_stub 和 server，DeepSeek 调用全部打到替身上；
+默认关掉 OCR 缓存和解答缓存，测的是 OCR 进程池和上游调用本身，加 --cache 才保留缓存。
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import zlib
+
+CORPUS_DIR = "bench_corpus"
+REQUEST_LOG = "requests.jsonl"
+
+PROBLEM_TEMPLATES = [
+    ("已知 f(x)=x^2-{b}x+{c}，求 f(x) 的单调区间", "f(x)=x^2-{b}x+{c}, find monotonic intervals"),
+    ("求函数 y={a}x^3-{b}x 的导数和极值", "y={a}x^3-{b}x, find y' and extrema"),
+    ("解不等式 {a}x+{b}>{c}", "Solve {a}x+{b}>{c}"),
+    ("等差数列 a1={a}，d={b}，求前 {c} 项和", "a1={a}, d={b}, find S{c}"),
+    ("解方程 x^2-{b}x+{c}=0", "Solve x^2-{b}x+{c}=0"),
+]
+
+_CJK_FONTS = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+    "/System/Library/Fonts/PingFang.ttc",
+]
+
+
+def make_problem(rng):
+    zh, en = rng.choice(PROBLEM_TEMPLATES)
+    values = {"a": rng.randint(1, 9), "b": rng.randint(1, 9), "c": rng.randint(2, 20)}
+    return zh.format(**values), en.format(**values)
+
+
+# ==================================================
+# 合成语料
+# ==================================================
+def build_corpus(n, out_dir, font_path=None, seed=0):
+    from PIL import Image, ImageDraw, ImageFont
+
+    rng = random.Random(seed)
+    font_path = font_path or next((p for p in _CJK_FONTS if os.path.exists(p)), None)
+    font = ImageFont.truetype(font_path, 40) if font_path else ImageFont.load_default()
+    os.makedirs(out_dir, exist_ok=True)
+
+    problems = []
+    for i in range(n):
+        zh, en = make_problem(rng)
+        text = zh if font_path else en     # 默认字体画不了中文
+        # 模拟手机拍照：尺寸不一、浅色背景、轻微噪点
+        w, h = rng.choice([(1280, 720), (2000, 1500), (3000, 4000)])
+        img = Image.new("RGB", (w, h), tuple(rng.randint(225, 255) for _ in range(3)))
+        draw = ImageDraw.Draw(img)
+        for line in range(rng.randint(1, 4)):
+            draw.text((60, 80 + line * 90), f"{line + 1}. {text}", fill=(20, 20, 20), font=font)
+        for _ in range(200):
+            x, y = rng.randrange(w), rng.randrange(h)
+            draw.point((x, y), fill=(rng.randint(150, 220),) * 3)
+
+        name = f"{i:04d}.jpg" if i % 2 else f"{i:04d}.png"
+        img.save(os.path.join(out_dir, name), quality=90)
+        problems.append({"file": name, "text": zh})
+
+    with open(os.path.join(out_dir, "problems.json"), "w", encoding="utf-8") as f:
+        json.dump(problems, f, ensure_ascii=False, indent=2)
+    print(f"🖼  已生成 {n} 张图片 → {out_dir}（字体：{font_path or '默认，仅英文'}）")
+
+
+def fill_log(n, corpus_dir, log_path, mix, seed=0):
+    rng = random.Random(seed)
+    with open(os.path.join(corpus_dir, "problems.json"), encoding="utf-8") as f:
+        problems = json.load(f)
+
+    weights = [float(x) for x in mix.split(",")]
+    paths = ["/api/ocr", "/api/parse", "/api/solve"]
+    with open(log_path, "a", encoding="utf-8") as f:
+        for _ in range(n):
+            path = rng.choices(paths, weights)[0]
+            if path == "/api/ocr":
+                record = {"path": path, "file": rng.choice(problems)["file"]}
+            else:
+                # 文本请求每条都重新生成，并发时不会因为同题合并而少打上游
+                text = f"{make_problem(rng)[0]}（#{rng.randrange(10 ** 6)}）"
+                if path == "/api/parse":
+                    record = {"path": path, "body": {"text": text}}
+                else:
+                    record = {"path": path, "body": {"problem": text, "level": "高中"}}
+            f.write(json.dumps({"ts": time.time(), **record}, ensure_ascii=False) + "\n")
+    print(f"📝 已追加 {n} 条请求 → {log_path}")
+
+
+# ==================================================
+# 回放
+# ==================================================
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+async def replay_level(base_url, records, corpus_dir, concurrency, total):
+    import httpx
+
+    files = sorted(f for f in os.listdir(corpus_dir) if f.endswith((".png", ".jpg")))
+    image_cache = {}
+
+    def image(name):
+        if not name or not os.path.exists(os.path.join(corpus_dir, name)):
+            name = files[zlib.crc32((name or "").encode()) % len(files)]
+        if name not in image_cache:
+            with open(os.path.join(corpus_dir, name), "rb") as f:
+                image_cache[name] = f.read()
+        return name, image_cache[name]
+
+    results = []          # (path, seconds, ok)
+    counter = iter(range(total))
+
+    async def worker(client):
+        for i in counter:
+            rec = records[i % len(records)]
+            path = rec["path"]
+            t0 = time.perf_counter()
+            try:
+                if path == "/api/ocr":
+                    name, data = image(rec.get("file"))
+                    r = await client.post(path, files={"file": (name, data)})
+                else:
+                    r = await client.post(path, json=rec.get("body", {}))
+                ok = r.status_code == 200 and '"error"' not in r.text[:200]
+            except httpx.HTTPError:
+                ok = False
+            results.append((path, time.perf_counter() - t0, ok))
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        wall = time.perf_counter() - t0
+    return results, wall
+
+
+def report(concurrency, results, wall):
+    rows = []
+    by_path = {}
+    for path, seconds, ok in results:
+        by_path.setdefault(path, []).append((seconds, ok))
+    by_path["ALL"] = [(s, ok) for _, s, ok in results]
+
+    for path, items in sorted(by_path.items()):
+        lat = sorted(s for s, _ in items)
+        errors = sum(1 for _, ok in items if not ok)
+        rows.append({
+            "concurrency": concurrency,
+            "endpoint": path,
+            "requests": len(items),
+            "errors": errors,
+            "rps": round(len(items) / wall, 2),
+            "p50_ms": round(1000 * percentile(lat, 50), 1),
+            "p95_ms": round(1000 * percentile(lat, 95), 1),
+            "p99_ms": round(1000 * percentile(lat, 99), 1),
+        })
+    return rows
+
+
+def print_rows(rows):
+    cols = ["concurrency", "endpoint", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in cols}
+    print("  ".join(c.ljust(widths[c]) for c in cols))
+    for r in rows:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in cols))
+
+
+def wait_ready(url, timeout=300):
+    import httpx
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} 在 {timeout}s 内未就绪")
+
+
+def spawn_services(port, stub_port, extra_env, cache=False):
+    env = dict(os.environ)
+    env.update({
+        "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{stub_port}",
+        "DEEPSEEK_API_KEY": "stub",
+        "OCR_STARTUP": "eager",
+    })
+    if not cache:
+        # 语料只有几十张图、几十道题，开着缓存时除第一轮外几乎全是命中
+        env.update({"OCR_CACHE_MAX_BYTES": "0", "OCR_CACHE_DB": "",
+                    "SOLVE_CACHE_TTL": "0"})
+    env.update(extra_env)
+    uvicorn = [sys.executable, "-m", "uvicorn", "--log-level", "warning"]
+    procs = [
+        subprocess.Popen(uvicorn + ["deepseek_stub:app", "--port", str(stub_port)], env=env),
+        subprocess.Popen(uvicorn + ["server:app", "--port", str(port)], env=env),
+    ]
+    wait_ready(f"http://127.0.0.1:{stub_port}/stats")
+    wait_ready(f"http://127.0.0.1:{port}/ready")
+    return procs
+
+
+# ==================================================
+# 知识点打标基准（纯 CPU，不需要起服务）
+# ==================================================
+def legacy_tags(question):
+    # 旧版 /api/parse 的 if/elif 链，作对比基线
+    if "f(x)" in question or "函数" in question:
+        return ["函数-单调性", "二次函数"]
+    elif "导数" in question:
+        return ["导数-求导", "导数-极值"]
+    return ["基础识别"]
+
+
+def cmd_tags(args):
+    from tag_engine import TagEngine
+
+    rng = random.Random(args.seed)
+    texts = [make_problem(rng)[0] for _ in range(args.n)]
+
+    t0 = time.perf_counter()
+    engine = TagEngine.load(args.taxonomy) if args.taxonomy else TagEngine.load()
+    compile_ms = 1000 * (time.perf_counter() - t0)
+
+    for name, fn in (("legacy if/elif", legacy_tags), ("tag_engine", engine.tag)):
+        t0 = time.perf_counter()
+        tagged = sum(len(fn(t)) for t in texts)
+        wall = time.perf_counter() - t0
+        print(f"{name:<15} {args.n / wall:>10.0f} 题/秒  {tagged / wall:>10.0f} 标签/秒  "
+              f"平均 {tagged / args.n:.2f} 个标签")
+    print(f"题库：{len(engine.tags)} 个知识点，{len(engine.words)} 个关键词，"
+          f"自动机 {len(engine.automaton.goto)} 个状态，编译 {compile_ms:.1f} ms")
+
+
+def cmd_replay(args):
+    with open(args.log, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records = [r for r in records if r.get("path") in ("/api/ocr", "/api/parse", "/api/solve")]
+    if not records:
+        sys.exit(f"❌ {args.log} 里没有可回放的请求，先运行 python bench.py fill")
+
+    procs = []
+    if args.spawn:
+        extra = dict(kv.split("=", 1) for kv in args.env)
+        procs = spawn_services(args.port, args.stub_port, extra, cache=args.cache)
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+
+    try:
+        rows = []
+        for c in (int(x) for x in args.concurrency.split(",")):
+            results, wall = asyncio.run(replay_level(base_url, records, args.corpus, c, args.requests))
+            level = report(c, results, wall)
+            rows += level
+            print_rows(level)
+            print()
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(rows, f, ensure_ascii=False, indent=2)
+            print(f"📊 结果已写入 {args.json}")
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="math-ocr 离线压测")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("corpus", help="生成合成题目图片")
+    p.add_argument("--n", type=int, default=50)
+    p.add_argument("--out", default=CORPUS_DIR)
+    p.add_argument("--font", help="中文字体路径，不指定时自动查找")
+    p.add_argument("--seed", type=int, default=0)
+
+    p = sub.add_parser("fill", help="按语料生成请求日志")
+    p.add_argument("--n", type=int, default=200)
+    p.add_argument("--corpus", default=CORPUS_DIR)
+    p.add_argument("--log", default=REQUEST_LOG)
+    p.add_argument("--mix", default="5,3,2", help="ocr,parse,solve 的权重")
+    p.add_argument("--seed", type=int, default=0)
+
+    p = sub.add_parser("replay", help="按并发梯度回放请求日志")
+    p.add_argument("--log", default=REQUEST_LOG)
+    p.add_argument("--corpus", default=CORPUS_DIR)
+    p.add_argument("--url", help="已在运行的服务地址；不指定则用 --port")
+    p.add_argument("--port", type=int, default=10000)
+    p.add_argument("--stub-port", type=int, default=18000)
+    p.add_argument("--spawn", action="store_true", help="本地拉起 deepseek_stub 和 server")
+    p.add_argument("--env", nargs="*", default=[], help="传给被拉起服务的环境变量 KEY=VALUE")
+    p.add_argument("--cache", action="store_true", help="--spawn 时保留 OCR/解答缓存（默认关闭）")
+    p.add_argument("--concurrency", default="1,4,16")
+    p.add_argument("--requests", type=int, default=200, help="每个并发档位的请求数")
+    p.add_argument("--json", help="把结果另存为 JSON，便于前后对比")
+
+    p = sub.add_parser("tags", help="知识点打标吞吐对比")
+    p.add_argument("--n", type=int, default=20000)
+    p.add_argument("--taxonomy", help="题库文件，默认 knowledge_tags.json")
+    p.add_argument("--seed", type=int, default=0)
+
+    args = ap.parse_args()
+    if args.cmd == "corpus":
+        build_corpus(args.n, args.out, args.font, args.seed)
+    elif args.cmd == "fill":
+        fill_log(args.n, args.corpus, args.log, args.mix, args.seed)
+    elif args.cmd == "tags":
+        cmd_tags(args)
+    else:
+        cmd_replay(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+本地 DeepSeek 替身：模拟 /v1/chat/completions，用于联调和压测，不消耗真实额度
+
+启动：
+    uvicorn deepseek_stub:app --port 18000
+    DEEPSEEK_BASE_URL=http://127.0.0.1:18000 DEEPSEEK_API_KEY=stub uvicorn server:app
+
+环境变量：
+    STUB_LATENCY_MS  每次回答的模拟耗时（默认 800）
+    STUB_FAIL_RATE   随机返回 503 的比例，用来验证重试（默认 0）
+    STUB_FENCE       为 1 时把 JSON 包在 ```json 围栏里，模拟模型不守规矩（默认 0）
+"""
+
+import asyncio
+import json
+import os
+import random
+import re
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_LATENCY_MS = float(os.environ.get("STUB_LATENCY_MS", 800))
+STUB_FAIL_RATE = float(os.environ.get("STUB_FAIL_RATE", 0))
+STUB_FENCE = os.environ.get("STUB_FENCE", "0") == "1"
+STUB_CHUNK_CHARS = 8
+
+app = FastAPI(title="DeepSeek Stub")
+calls = {"total": 0, "failed": 0}
+
+
+def fake_solution(prompt: str) -> str:
+    m = re.search(r"题目：(.*)", prompt)
+    problem = m.group(1).strip() if m else ""
+    content = json.dumps({
+        "problem": problem,
+        "final_answer": "x = 1 或 x = 2",
+        "steps": [
+            {"step": "1", "content": "整理方程", "explain": "移项得到标准形式"},
+            {"step": "2", "content": "因式分解", "explain": "(x-1)(x-2)=0"},
+            {"step": "3", "content": "求解", "explain": "分别令两个因式为 0"},
+        ],
+        "why": "二次方程优先尝试因式分解",
+        "similar": ["解方程 x^2-5x+6=0", "解方程 x^2-4x+3=0"],
+    }, ensure_ascii=False, indent=2)
+    if STUB_FENCE:
+        content = f"```json\n{content}\n```"
+    return content
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    calls["total"] += 1
+
+    if random.random() < STUB_FAIL_RATE:
+        calls["failed"] += 1
+        return JSONResponse({"error": {"message": "stub overloaded"}}, status_code=503)
+
+    prompt = body["messages"][-1]["content"]
+    if body.get("stream"):
+        return StreamingResponse(stream_completion(body, fake_solution(prompt)),
+                                 media_type="text/event-stream")
+
+    await asyncio.sleep(STUB_LATENCY_MS / 1000)
+    return {
+        "id": f"stub-{calls['total']}",
+        "object": "chat.completion",
+        "model": body.get("model", "deepseek-chat"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": fake_solution(prompt)},
+            "finish_reason": "stop",
+        }],
+    }
+
+
+async def stream_completion(body, content):
+    # 总耗时与非流式一致，按块均匀摊开
+    pieces = [content[i:i + STUB_CHUNK_CHARS] for i in range(0, len(content), STUB_CHUNK_CHARS)]
+    delay = STUB_LATENCY_MS / 1000 / max(len(pieces), 1)
+    for piece in pieces:
+        await asyncio.sleep(delay)
+        chunk = {
+            "id": f"stub-{calls['total']}",
+            "object": "chat.completion.chunk",
+            "model": body.get("model", "deepseek-chat"),
+            "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.get("/stats")
+async def stats():
+    return calls
@@ -0,0 +1,154 @@
+"""
+图片预处理：限长流式读取 + 按目标尺寸降采样解码 + EXIF 方向校正
+
+用法（对比旧流程的解码耗时与峰值内存）：
+    python image_ingest.py photo.jpg [photo2.jpg ...]
+"""
+
+import io
+import math
+import os
+import sys
+import time
+import zipfile
+
+OCR_MAX_UPLOAD_BYTES = int(os.environ.get("OCR_MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+OCR_MAX_SIDE = int(os.environ.get("OCR_MAX_SIDE", 2000))
+OCR_BATCH_MAX_FILES = int(os.environ.get("OCR_BATCH_MAX_FILES", 100))
+OCR_BATCH_MAX_BYTES = int(os.environ.get("OCR_BATCH_MAX_BYTES", 100 * 1024 * 1024))
+
+_IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+_CHUNK = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """上传超过 OCR_MAX_UPLOAD_BYTES，调用方应返回 413"""
+
+
+async def read_upload(file, limit: int = OCR_MAX_UPLOAD_BYTES) -> bytes:
+    """分块读取 UploadFile，超过上限立即中止，不把整个大文件读进内存"""
+    if file.size is not None and file.size > limit:
+        raise UploadTooLarge(f"图片过大（>{limit // (1024 * 1024)}MB）")
+
+    chunks, total = [], 0
+    while True:
+        chunk = await file.read(_CHUNK)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > limit:
+            raise UploadTooLarge(f"图片过大（>{limit // (1024 * 1024)}MB）")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def is_zip(file) -> bool:
+    name = (file.filename or "").lower()
+    return name.endswith(".zip") or file.content_type in ("application/zip", "application/x-zip-compressed")
+
+
+def zip_images(zf: zipfile.ZipFile):
+    """zip 里的图片条目（按文件名排序，跳过目录和 macOS 元数据）"""
+    return sorted(
+        (info for info in zf.infolist()
+         if not info.is_dir()
+         and not info.filename.startswith("__MACOSX/")
+         and info.filename.lower().endswith(_IMAGE_EXTS)),
+        key=lambda info: info.filename,
+    )
+
+
+def read_zip_entry(zf: zipfile.ZipFile, info: zipfile.ZipInfo, limit: int = OCR_MAX_UPLOAD_BYTES) -> bytes:
+    # file_size 可被伪造，解压时再按实际长度截断一次
+    if info.file_size > limit:
+        raise UploadTooLarge(f"{info.filename} 过大（>{limit // (1024 * 1024)}MB）")
+    with zf.open(info) as f:
+        data = f.read(limit + 1)
+    if len(data) > limit:
+        raise UploadTooLarge(f"{info.filename} 过大（>{limit // (1024 * 1024)}MB）")
+    return data
+
+
+def peak_rss_kb() -> int:
+    try:
+        import resource
+    except ImportError:      # Windows
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def decode_image(img_bytes: bytes, max_side: int = OCR_MAX_SIDE):
+    """
+    解码成 RapidOCR 需要的 RGB ndarray，长边不超过 max_side。
+    JPEG 走 draft 模式在解码阶段就按 1/2、1/4、1/8 缩小，不会生成全尺寸位图；
+    其他格式解码后再缩。返回 (ndarray, 信息字典)。
+    """
+    from PIL import Image, ImageOps
+    import numpy as np
+
+    t0 = time.perf_counter()
+    image = Image.open(io.BytesIO(img_bytes))
+    raw_size = image.size
+
+    # Pillow 按 min(w // 目标宽, h // 目标高) 选缩放倍数，目标必须与原图同比例
+    if max(raw_size) > max_side:
+        scale = max_side / max(raw_size)
+        image.draft("RGB", tuple(math.ceil(side * scale) for side in raw_size))
+
+    image = ImageOps.exif_transpose(image)
+    image.load()
+    t1 = time.perf_counter()
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+
+    # asarray 直接基于 PIL 导出的缓冲区，不再额外拷贝一份
+    img_np = np.asarray(image)
+    del image
+
+    return img_np, {
+        "raw_size": raw_size,
+        "size": (img_np.shape[1], img_np.shape[0]),
+        "load_ms": round(1000 * (t1 - t0), 1),
+        "convert_ms": round(1000 * (time.perf_counter() - t1), 1),
+        "decode_ms": round(1000 * (time.perf_counter() - t0), 1),
+    }
+
+
+# ==================================================
+# 对比测量：旧流程 vs 新流程（各自在独立子进程里跑，峰值内存互不干扰）
+# ==================================================
+def _legacy_decode(img_bytes: bytes):
+    from PIL import Image
+    import numpy as np
+
+    t0 = time.perf_counter()
+    image = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+    img_np = np.array(image)
+    return img_np, {"size": image.size, "decode_ms": round(1000 * (time.perf_counter() - t0), 1)}
+
+
+def _measure(mode: str, path: str):
+    from PIL import Image  # noqa: F401  先导入，避免把库本身算进增量
+    import numpy  # noqa: F401
+
+    with open(path, "rb") as f:
+        img_bytes = f.read()
+    base = peak_rss_kb()
+    img_np, info = (_legacy_decode if mode == "legacy" else decode_image)(img_bytes)
+    info["peak_rss_delta_kb"] = peak_rss_kb() - base
+    return info
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ProcessPoolExecutor
+
+    for path in sys.argv[1:]:
+        print(f"📷 {path}")
+        for mode in ("legacy", "ingest"):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                info = pool.submit(_measure, mode, path).result()
+            print(f"   {mode:<7} 尺寸 {info['size']}  解码 {info['decode_ms']} ms  "
+                  f"峰值内存增量 {info['peak_rss_delta_kb'] / 1024:.1f} MB")
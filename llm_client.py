@@ -0,0 +1,277 @@
+"""
+DeepSeek 异步客户端：长连接池 + 连接/读取超时 + 并发上限 + 429/5xx 抖动重试，
+以及同题请求合并和 TTL 解答缓存
+"""
+
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+# 本地压测时指向 deepseek_stub.py，例如 http://127.0.0.1:18000
+DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+DEEPSEEK_MODEL = os.environ.get("DEEPSEEK_MODEL", "deepseek-chat")
+
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 5))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 120))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+
+SOLVE_CACHE_TTL = float(os.environ.get("SOLVE_CACHE_TTL", 24 * 3600))   # 0 不缓存，只合并并发请求
+SOLVE_CACHE_SIZE = int(os.environ.get("SOLVE_CACHE_SIZE", 2048))
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+def normalize_problem(problem: str) -> str:
+    """全角转半角、去掉所有空白，OCR 结果里的排版差异不影响命中"""
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", problem))
+
+
+# ==================================================
+# HTTP 客户端
+# ==================================================
+class DeepSeekClient:
+    def __init__(self, api_key: str = DEEPSEEK_API_KEY, base_url: str = DEEPSEEK_BASE_URL,
+                 model: str = DEEPSEEK_MODEL, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._client = None
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _backoff(self, attempt: int, retry_after: str = None):
+        # 服务端给了 Retry-After 就听它的，否则指数退避 + 全抖动
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), 30.0)
+        return random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+
+    def _payload(self, prompt: str, **extra):
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            **extra,
+        }
+
+    def _transport_retry(self, attempt: int, exc):
+        """连接被重置、握手失败等传输层错误：还有重试次数就返回退避时间，否则抛出"""
+        if attempt == self.max_retries:
+            self.errors += 1
+            raise LLMError(f"DeepSeek 连接失败：{exc!r}") from exc
+        self.retries += 1
+        return self._backoff(attempt)
+
+    async def chat(self, prompt: str) -> str:
+        if not self.api_key:
+            raise LLMError("缺少 DEEPSEEK_API_KEY 环境变量")
+
+        import httpx
+        client = self._http()
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            try:
+                # 只在请求期间占并发名额，退避等待时让给别的请求
+                async with self._sem:
+                    r = await client.post("/v1/chat/completions", json=self._payload(prompt))
+            except (httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                delay = self._transport_retry(attempt, e)
+            except httpx.TimeoutException:
+                self.errors += 1
+                raise LLMError("DeepSeek 响应超时", status=504)
+            except httpx.TransportError as e:
+                # 含复用长连接时被对端重置的 ReadError / WriteError
+                delay = self._transport_retry(attempt, e)
+            else:
+                if r.status_code in _RETRY_STATUS and attempt < self.max_retries:
+                    self.retries += 1
+                    delay = self._backoff(attempt, r.headers.get("Retry-After"))
+                elif r.status_code != 200:
+                    self.errors += 1
+                    raise LLMError(f"DeepSeek 返回 {r.status_code}：{r.text[:200]}", status=r.status_code)
+                else:
+                    data = r.json()
+                    return data["choices"][0]["message"]["content"]
+            await asyncio.sleep(delay)
+
+    async def stream_chat(self, prompt: str):
+        """流式调用，逐段产出模型输出的文本；只在收到首字节之前重试"""
+        if not self.api_key:
+            raise LLMError("缺少 DEEPSEEK_API_KEY 环境变量")
+
+        import httpx
+        client = self._http()
+        started = False
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            try:
+                async with self._sem:
+                    async with client.stream("POST", "/v1/chat/completions",
+                                             json=self._payload(prompt, stream=True)) as r:
+                        if r.status_code in _RETRY_STATUS and attempt < self.max_retries:
+                            self.retries += 1
+                            delay = self._backoff(attempt, r.headers.get("Retry-After"))
+                        elif r.status_code != 200:
+                            self.errors += 1
+                            body = (await r.aread()).decode("utf-8", "replace")
+                            raise LLMError(f"DeepSeek 返回 {r.status_code}：{body[:200]}", status=r.status_code)
+                        else:
+                            async for line in r.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[5:].strip()
+                                if data == "[DONE]":
+                                    return
+                                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                                if delta:
+                                    started = True
+                                    yield delta
+                            return
+            except (httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                delay = self._transport_retry(attempt, e)
+            except httpx.TimeoutException:
+                self.errors += 1
+                raise LLMError("DeepSeek 响应超时", status=504)
+            except httpx.TransportError as e:
+                if started:
+                    # 已经产出过内容，重试会让调用方收到重复文本
+                    self.errors += 1
+                    raise LLMError(f"DeepSeek 流式响应中断：{e!r}") from e
+                delay = self._transport_retry(attempt, e)
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "base_url": self.base_url,
+            "max_concurrency": self.max_concurrency,
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+        }
+
+
+# ==================================================
+# 解答缓存：TTL + LRU，相同 key 的并发请求只打一次上游
+# ==================================================
+class SolutionCache:
+    def __init__(self, ttl: float = SOLVE_CACHE_TTL, max_entries: int = SOLVE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()      # key -> (expires_at, value)
+        self._inflight = {}                # key -> Future
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def claim(self, key):
+        """
+        查缓存并登记，命中/合并/未命中的统计与 get_or_compute 一致。供自己驱动上游调用的流式接口使用：
+            ("hit", value)    缓存命中
+            ("wait", future)  同 key 已有请求在途，await asyncio.shield(future) 共享它的结果
+            ("lead", future)  由调用方发起上游请求，结束时必须 set_result / set_exception
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return "hit", value
+
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return "wait", fut
+
+        self.misses += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        fut.add_done_callback(lambda f: self._settle(key, f))
+        return "lead", fut
+
+    async def get_or_compute(self, key, compute):
+        state, value = self.claim(key)
+        if state == "hit":
+            return value
+        if state == "lead":
+            task = asyncio.ensure_future(compute())
+            task.add_done_callback(lambda t: _copy_result(t, value))
+        # shield：某个等待方断开不能把共享的上游调用一起取消
+        return await asyncio.shield(value)
+
+    def _settle(self, key, fut):
+        # 即使所有等待方都已断开，上游结果照样写进缓存；失败不缓存
+        self._inflight.pop(key, None)
+        if not fut.cancelled() and fut.exception() is None:
+            self.put(key, fut.result())
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+        }
+
+
+def _copy_result(task, fut):
+    if fut.done():
+        return
+    if task.cancelled():
+        fut.cancel()
+    elif task.exception() is not None:
+        fut.set_exception(task.exception())
+    else:
+        fut.set_result(task.result())
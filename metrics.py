@@ -0,0 +1,162 @@
+"""
+热路径埋点：分阶段耗时直方图、在途请求数、分阶段错误计数，输出 Prometheus 文本格式
+"""
+
+import bisect
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+# 为 1 时在响应头里附带本次请求的 Server-Timing
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+_DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 当前请求的阶段耗时 [(stage, seconds)]，由中间件在请求开始时设置
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, v in self.values.items():
+            yield self.name, _labels(self.labelnames, labels), v
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=_DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}       # labels -> [每个桶的计数..., +Inf 计数, sum]
+
+    def observe(self, value, *labels):
+        row = self.values.get(labels)
+        if row is None:
+            row = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        for labels, row in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += count
+                yield self.name + "_bucket", _labels(names, labels + (_num(bound),)), cumulative
+            yield self.name + "_sum", _labels(self.labelnames, labels), row[-1]
+            yield self.name + "_count", _labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []   # 抓取时才计算的指标：fn() -> [(name, kind, help, labels dict, value)]
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        out = []
+        for m in self.metrics:
+            out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                out.append(f"{name}{labels} {_num(value)}")
+
+        seen = set()
+        for fn in self.collectors:
+            for name, kind, help, labels, value in fn():
+                if value is None:
+                    continue
+                if name not in seen:
+                    seen.add(name)
+                    out.append(f"# HELP {name} {help}")
+                    out.append(f"# TYPE {name} {kind}")
+                out.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_num(value)}")
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "mathocr_stage_seconds", "各处理阶段耗时", labels=("stage",)))
+STAGE_ERRORS = registry.register(Counter(
+    "mathocr_stage_errors_total", "各处理阶段失败次数", labels=("stage", "error")))
+REQUEST_SECONDS = registry.register(Histogram(
+    "mathocr_request_seconds", "接口总耗时", labels=("endpoint", "status")))
+INFLIGHT = registry.register(Gauge(
+    "mathocr_inflight_requests", "正在处理的请求数", labels=("endpoint",)))
+
+
+def observe(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+def error(stage: str, exc: BaseException):
+    STAGE_ERRORS.inc(stage, type(exc).__name__)
+
+
+@contextmanager
+def timed(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        error(stage, e)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - t0)
+
+
+def server_timing(timings):
+    # 同一阶段出现多次（批量接口）时合并
+    merged = {}
+    for stage, seconds in timings:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={1000 * s:.1f}" for stage, s in merged.items())
@@ -0,0 +1,168 @@
+"""
+OCR 结果缓存：按内容哈希精确命中，内存 LRU + 可选 SQLite 持久化
+
+不做感知哈希近似匹配：版式相同的不同试卷（只差一两行字）在任何低分辨率签名上都几乎一样，
+而同一张图重新压缩、缩放后签名反而可能差得更多，命中错了就会把别人的识别结果返回给当前用户。
+磁盘读写放到线程里，不占事件循环。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+OCR_CACHE_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", 32 * 1024 * 1024))  # 0 关闭内存缓存
+OCR_CACHE_DB = os.environ.get("OCR_CACHE_DB", "")          # 为空则只用内存
+OCR_CACHE_DB_MAX_ROWS = int(os.environ.get("OCR_CACHE_DB_MAX_ROWS", 100000))
+
+# 每条缓存的固定开销估算（key、哈希、容器对象）
+_ENTRY_OVERHEAD = 256
+
+
+def content_key(img_bytes: bytes) -> str:
+    return hashlib.sha256(img_bytes).hexdigest()
+
+
+def _entry_size(lines):
+    return _ENTRY_OVERHEAD + sum(len(line.encode("utf-8")) for line in lines)
+
+
+class OCRCache:
+    def __init__(self, max_bytes: int = OCR_CACHE_MAX_BYTES, db_path: str = OCR_CACHE_DB,
+                 db_max_rows: int = OCR_CACHE_DB_MAX_ROWS):
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.db_max_rows = db_max_rows
+        self._lru = OrderedDict()      # key -> lines
+        self._bytes = 0
+        self.counters = {
+            "hits_memory": 0,
+            "hits_disk": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+        self._db = None
+        self._reader = None
+        self._read_lock = threading.Lock()
+        # 所有写入由单个线程串行执行，put() 不等待落盘
+        self._writer = None
+        self._puts = 0
+        self._open_lock = threading.Lock()
+
+    def open(self):
+        """
+        打开磁盘缓存；可重复调用。由应用启动时调用而不是在构造时：
+        模块级实例在 import 时创建，gunicorn --preload 下连接会被 fork 进每个 worker 共用。
+        打开之前只用内存一级。
+        """
+        with self._open_lock:
+            if not self.db_path or self._db is not None:
+                return
+            db = self._connect(self.db_path)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                " key TEXT PRIMARY KEY, lines TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_created ON ocr_cache (created)")
+            db.commit()
+            self._reader = self._connect(self.db_path)
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr-cache-writer")
+            self._db = db
+
+    @staticmethod
+    def _connect(path):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    async def get(self, key: str):
+        lines = self._lru.get(key)
+        if lines is not None:
+            self._lru.move_to_end(key)
+            self.counters["hits_memory"] += 1
+            return lines
+
+        if self._db is not None:
+            lines = await asyncio.to_thread(self._load, key)
+            if lines is not None:
+                self.counters["hits_disk"] += 1
+                self._remember(key, lines)
+                return lines
+        self.counters["misses"] += 1
+        return None
+
+    def put(self, key: str, lines):
+        self._remember(key, lines)
+        if self._writer is not None:
+            self._writer.submit(self._write, key, json.dumps(lines, ensure_ascii=False), time.time())
+
+    # ---------- 内部 ----------
+    def _remember(self, key, lines):
+        if self.max_bytes <= 0:
+            return
+        if key in self._lru:
+            self._bytes -= _entry_size(self._lru.pop(key))
+        self._lru[key] = lines
+        self._bytes += _entry_size(lines)
+
+        while self._bytes > self.max_bytes and len(self._lru) > 1:
+            _, old_lines = self._lru.popitem(last=False)
+            self._bytes -= _entry_size(old_lines)
+            self.counters["evictions"] += 1
+
+    def _load(self, key):
+        with self._read_lock:
+            row = self._reader.execute("SELECT lines FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, key, lines_json, created):
+        # 写线程内执行
+        self._db.execute(
+            "INSERT OR REPLACE INTO ocr_cache (key, lines, created) VALUES (?, ?, ?)",
+            (key, lines_json, created),
+        )
+        self._db.commit()
+        # COUNT(*) 要扫全表，隔一段再检查上限
+        self._puts += 1
+        if self._puts % 256 == 1:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        (rows,) = self._db.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()
+        excess = rows - self.db_max_rows
+        if excess <= 0:
+            return
+        stale = [k for (k,) in self._db.execute(
+            "SELECT key FROM ocr_cache ORDER BY created LIMIT ?", (excess,))]
+        self._db.executemany("DELETE FROM ocr_cache WHERE key = ?", [(k,) for k in stale])
+        self._db.commit()
+        self.counters["evictions"] += len(stale)
+
+    def close(self):
+        with self._open_lock:
+            if self._writer is not None:
+                self._writer.shutdown(wait=True)
+                self._writer = None
+            for conn in (self._db, self._reader):
+                if conn is not None:
+                    conn.close()
+            self._db = self._reader = None
+
+    def stats(self):
+        hits = self.counters["hits_memory"] + self.counters["hits_disk"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            "entries": len(self._lru),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "disk": self._db is not None,
+        }
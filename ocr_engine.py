@@ -0,0 +1,500 @@
+"""
+OCR 执行引擎：多进程 RapidOCR 工作池 + 有界队列 + 单任务超时
+
+启动模式（OCR_STARTUP）：
+    lazy     第一次识别时才拉起进程池、加载模型（默认，冷启动最快）
+    eager    启动后立即拉起进程池，并在每个 worker 上用合成图片预热一次
+    prefork  在父进程加载模型（不做推理），fork 出的 worker 共享只读内存页（仅 Linux），
+             预热在 fork 之后于各 worker 内进行；多个 Web 进程也要共享时用 gunicorn --preload 启动
+"""
+
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from image_ingest import decode_image, peak_rss_kb
+
+def _default_workers():
+    # 容器里 cpu_count() 是宿主机核数；按本进程可用的 CPU 算，且每个 worker 一份模型，默认最多 4 个
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return min(cpus, 4)
+
+
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", _default_workers()))
+OCR_QUEUE_SIZE = int(os.environ.get("OCR_QUEUE_SIZE", 16))
+OCR_TIMEOUT = float(os.environ.get("OCR_TIMEOUT", 30))
+# 超时后再等这么久子进程仍未返回，就认定 worker 卡死，整池重建
+OCR_KILL_AFTER = float(os.environ.get("OCR_KILL_AFTER", OCR_TIMEOUT))
+OCR_STARTUP = os.environ.get("OCR_STARTUP", "lazy")
+# 预热时等待所有 worker 到齐的上限（含模型加载）
+OCR_WARMUP_TIMEOUT = float(os.environ.get("OCR_WARMUP_TIMEOUT", 300))
+
+# 跨请求微批：把多张图的文本行切片攒在一起送识别模型
+OCR_MICROBATCH = os.environ.get("OCR_MICROBATCH", "0") == "1"
+OCR_REC_BATCH_SIZE = int(os.environ.get("OCR_REC_BATCH_SIZE", 64))
+OCR_REC_MAX_WAIT_MS = float(os.environ.get("OCR_REC_MAX_WAIT_MS", 10))
+
+
+class OCRBusy(Exception):
+    """队列已满，调用方应返回 429 并带上 Retry-After"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"OCR 队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+class OCRTimeout(Exception):
+    """单个 OCR 任务超过时限"""
+
+
+class OCRUnavailable(Exception):
+    """模型加载失败，或 worker 进程异常退出且重提后仍失败，调用方应返回 503"""
+
+
+# ==================================================
+# 子进程：每个 worker 只加载一次 RapidOCR
+# ==================================================
+_ocr = None
+_barrier = None
+
+
+def _init_worker(barrier=None, failed=None):
+    global _ocr, _barrier
+    _barrier = barrier
+    if _ocr is not None:      # prefork：已从父进程继承
+        return
+    try:
+        from rapidocr_paddle import RapidOCR
+        _ocr = RapidOCR()
+    except BaseException:
+        # 进程池只会报 BrokenProcessPool，分不出是加载失败还是任务把进程搞崩，这里告诉父进程
+        if failed is not None:
+            failed.set()
+        raise
+
+
+def _memory():
+    """当前进程内存（KB）。PSS 按共享页均摊，能看出 prefork 省下的部分"""
+    info = {"pid": os.getpid(), "peak_rss_kb": peak_rss_kb()}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith(("Rss:", "Pss:")):
+                    name, value = line.split()[:2]
+                    info[name[:-1].lower() + "_kb"] = int(value)
+    except OSError:
+        pass
+    return info
+
+
+def _synthetic_image():
+    import cv2
+    import numpy as np
+
+    img = np.full((160, 640, 3), 255, dtype=np.uint8)
+    cv2.putText(img, "f(x)=x^2-3x+2", (20, 100), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0, 0, 0), 3)
+    return img
+
+
+def _warmup():
+    """
+    跑一次完整推理，把图初始化、内存池分配等一次性开销提前付掉。
+    跑完在屏障处等其余 worker：每个进程恰好领到一个预热任务，不会有 worker 领两个、另一个没预热。
+    """
+    t0 = time.perf_counter()
+    _ocr(_synthetic_image())
+    info = {"warmup_ms": round(1000 * (time.perf_counter() - t0), 1), **_memory()}
+    if _barrier is not None:
+        _barrier.wait(OCR_WARMUP_TIMEOUT)
+    return info
+
+
+def preload():
+    """
+    prefork 模式：只在父进程里加载模型，之后 fork 的子进程直接复用。
+    不在父进程推理：推理会拉起 Paddle/OpenMP 线程池，带着这些线程 fork 可能让子进程死锁。
+    """
+    t0 = time.perf_counter()
+    _init_worker()
+    return {"load_ms": round(1000 * (time.perf_counter() - t0), 1), **_memory()}
+
+
+def _ocr_bytes(img_bytes: bytes):
+    img_np, info = decode_image(img_bytes)
+    result, elapse = _ocr(img_np)
+    del img_np
+
+    # RapidOCR 返回 [det, cls, rec] 三段耗时
+    if isinstance(elapse, (list, tuple)) and len(elapse) == 3:
+        for stage, seconds in zip(("det", "cls", "rec"), elapse):
+            info[f"{stage}_ms"] = round(1000 * (seconds or 0), 1)
+
+    info["memory"] = _memory()
+    lines = [line[1] for line in result] if result else []
+    return lines, info
+
+
+def _sorted_boxes(dt_boxes):
+    """从上到下、从左到右，同一行（y 差 < 10px）内按 x 排序"""
+    boxes = sorted(dt_boxes, key=lambda b: (b[0][1], b[0][0]))
+    for i in range(len(boxes) - 1):
+        for j in range(i, -1, -1):
+            if abs(boxes[j + 1][0][1] - boxes[j][0][1]) < 10 and boxes[j + 1][0][0] < boxes[j][0][0]:
+                boxes[j], boxes[j + 1] = boxes[j + 1], boxes[j]
+            else:
+                break
+    return boxes
+
+
+def _crop(img, points):
+    import cv2
+    import numpy as np
+
+    points = np.asarray(points, dtype=np.float32)
+    w = int(max(np.linalg.norm(points[0] - points[1]), np.linalg.norm(points[2] - points[3])))
+    h = int(max(np.linalg.norm(points[0] - points[3]), np.linalg.norm(points[1] - points[2])))
+    dst = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    crop = cv2.warpPerspective(img, cv2.getPerspectiveTransform(points, dst), (w, h),
+                               borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    # 竖排文本行转成横向
+    if h and h / max(w, 1) >= 1.5:
+        crop = np.rot90(crop)
+    return crop
+
+
+def _det_crops(img_bytes: bytes):
+    """微批模式第一段：解码 + 检测 + 方向分类，返回待识别的文本行切片"""
+    img_np, info = decode_image(img_bytes)
+    dt_boxes, det_elapse = _ocr.text_det(img_np)
+    info["det_ms"] = round(1000 * (det_elapse or 0), 1)
+    if dt_boxes is None or len(dt_boxes) == 0:
+        info["memory"] = _memory()
+        return [], info
+
+    crops = [_crop(img_np, box) for box in _sorted_boxes(dt_boxes)]
+    del img_np
+    crops, _, cls_elapse = _ocr.text_cls(crops)
+    info["cls_ms"] = round(1000 * (cls_elapse or 0), 1)
+    info["memory"] = _memory()
+    return crops, info
+
+
+def _rec_batch(crops):
+    """微批模式第二段：一次识别多个请求的切片，低分结果置空"""
+    rec_res, elapse = _ocr.text_rec(crops)
+    min_score = getattr(_ocr, "text_score", 0.5)
+    return [text if score >= min_score else "" for text, score in rec_res], elapse
+
+
+# ==================================================
+# 主进程：异步提交 + 背压
+# ==================================================
+class OCREngine:
+    def __init__(self, workers: int = OCR_WORKERS, queue_size: int = OCR_QUEUE_SIZE,
+                 timeout: float = OCR_TIMEOUT, mode: str = OCR_STARTUP,
+                 kill_after: float = OCR_KILL_AFTER):
+        self.mode = mode
+        self.state = "cold"          # cold -> loading -> ready / failed
+        self.ready_at = None
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.kill_after = kill_after
+        self._pool = None
+        self._init_failed = None     # 当前进程池的模型加载失败标记
+        self._inflight = 0
+        self._started_at = time.monotonic()
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failed = 0
+        self.restarts = 0
+        self.busy_seconds = 0.0
+        self.images = 0
+        self.decode_seconds = 0.0
+        self.worker_memory = {}      # pid -> _memory()
+        self.batcher = RecBatcher(self) if OCR_MICROBATCH else None
+
+    @property
+    def capacity(self):
+        return self.workers + self.queue_size
+
+    def start(self):
+        if self._pool is None:
+            # prefork 必须用 fork 才能继承父进程里已加载的模型
+            ctx = multiprocessing.get_context("fork" if self.mode == "prefork" else None)
+            # 屏障和失败标记只能随进程创建传入（initargs），每个池各用一份
+            self._init_failed = ctx.Event()
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx,
+                                             initializer=_init_worker,
+                                             initargs=(ctx.Barrier(self.workers), self._init_failed))
+            self._started_at = time.monotonic()
+            if self.state == "cold":
+                self.state = "loading"
+
+    async def warm_up(self):
+        """每个 worker 各预热一次（屏障保证一个进程一个任务）；不走排队，模型加载可能很慢"""
+        self.start()
+        try:
+            infos = await asyncio.gather(*[asyncio.wrap_future(self._pool.submit(_warmup))
+                                           for _ in range(self.workers)])
+        except Exception:
+            self.state = "failed"
+            raise
+        for info in infos:
+            self.worker_memory[info["pid"]] = info
+        self._mark_ready()
+        return infos
+
+    def _mark_ready(self):
+        if self.state != "ready":
+            self.state = "ready"
+            self.ready_at = time.monotonic()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _restart(self, pool):
+        """
+        worker 被杀（OOM 等）后进程池进入 BrokenProcessPool，之后的提交全部失败；
+        worker 卡死则一直占着名额。两种情况都杀掉旧池里的进程、重建新池。
+        旧池上未完成的 future 会以取消或 BrokenProcessPool 结束，名额随回调释放，
+        仍在等待的请求由 submit() 换到新池重提。
+        """
+        if pool is not self._pool:
+            return                   # 已被别的请求重建过
+        processes = list((getattr(pool, "_processes", None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for p in processes:
+            if p.is_alive():
+                p.kill()
+        self._pool = None
+        self.worker_memory.clear()
+        if self._init_failed.is_set():
+            # 模型加载失败重建也没用，不再重试；/ready 返回 503 交给编排系统处理
+            self.state = "failed"
+            print("❌ OCR 模型加载失败，停止重建进程池")
+            return
+        self.restarts += 1
+        self.state = "loading"
+        try:
+            self.start()
+        except Exception:
+            self.state = "failed"
+            raise
+        if self.mode in ("eager", "prefork"):
+            asyncio.ensure_future(self._rewarm())
+
+    async def _rewarm(self):
+        try:
+            await self.warm_up()
+            print(f"✅ OCR 进程池已重建并预热（第 {self.restarts} 次）")
+        except Exception as e:
+            print(f"❌ OCR 进程池重建后预热失败：{e}")
+
+    def _reap(self, cf, pool):
+        if not cf.done():
+            print(f"⚠️ OCR worker 超时 {self.timeout + self.kill_after:g}s 仍未返回，重建进程池")
+            self._restart(pool)
+
+    def retry_after(self):
+        # 按平均耗时估算排到队首需要多久
+        avg = self.busy_seconds / self.completed if self.completed else self.timeout
+        waves = math.ceil(self._inflight / self.workers)
+        return max(1, math.ceil(avg * waves))
+
+    def _check_loaded(self):
+        if self._pool is None and self._init_failed is not None and self._init_failed.is_set():
+            raise OCRUnavailable("OCR 模型加载失败，服务暂不可用")
+
+    def _submit(self, fn, args):
+        self._check_loaded()
+        self.start()
+        pool = self._pool
+        try:
+            cf = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            # 任务还没发出去，换新池重提一次是安全的
+            self._restart(pool)
+            self._check_loaded()
+            pool = self._pool
+            cf = pool.submit(fn, *args)
+        return cf, pool
+
+    async def submit(self, fn, *args, admitted: bool = False):
+        """admitted=True 表示该任务是已准入请求的后续阶段（微批识别），不再做容量检查，
+        否则检测阶段已经跑完的请求可能在识别阶段被 429 拒掉"""
+        if not admitted and self._inflight >= self.capacity:
+            self.rejected += 1
+            raise OCRBusy(self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        crashed = False
+        while True:
+            # 提交成功才占名额；以进程池 future 的完成为准释放：超时后子进程仍在跑，不能提前放行
+            cf, pool = self._submit(fn, args)
+            self._inflight += 1
+            t0 = time.monotonic()
+            cf.add_done_callback(lambda f, t0=t0: loop.call_soon_threadsafe(self._done, f, t0))
+
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(cf), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                if not cf.cancel():
+                    # 已在子进程里执行，取消不掉；宽限期后还没结束就重建进程池
+                    loop.call_later(self.kill_after, self._reap, cf, pool)
+                raise OCRTimeout(f"OCR 超时（>{self.timeout:g}s）")
+            except asyncio.CancelledError:
+                # 调用方自己被取消（客户端断开等）照常上抛；
+                # 只有进程池重建时排队任务被 cancel_futures 取消才换新池重提，这类任务从未执行过
+                if not cf.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            except BrokenProcessPool:
+                # 正在执行的任务随旧池一起被杀，可能是被别的任务连累，也可能自己就是元凶，只重提一次
+                self._restart(pool)
+                if crashed:
+                    raise OCRUnavailable("OCR worker 进程异常退出，请稍后重试")
+                crashed = True
+            if loop.time() >= deadline:
+                self.timeouts += 1
+                raise OCRTimeout(f"OCR 超时（>{self.timeout:g}s）")
+
+    def _done(self, f, t0):
+        self._inflight -= 1
+        if f.cancelled():
+            return
+        self.busy_seconds += time.monotonic() - t0
+        if f.exception() is None:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+    async def recognize(self, img_bytes: bytes):
+        with metrics.timed("ocr_job"):
+            if self.batcher is not None:
+                crops, info = await self.submit(_det_crops, img_bytes)
+                lines = [text for text in await self.batcher.recognize(crops) if text]
+            else:
+                lines, info = await self.submit(_ocr_bytes, img_bytes)
+        for stage in ("load", "convert", "det", "cls", "rec"):
+            if f"{stage}_ms" in info:
+                metrics.observe(stage, info[f"{stage}_ms"] / 1000)
+        self.images += 1
+        self.decode_seconds += info["decode_ms"] / 1000
+        self.worker_memory[info["memory"]["pid"]] = info["memory"]
+        self._mark_ready()
+        return lines
+
+    def stats(self):
+        busy = min(self._inflight, self.workers)
+        uptime = max(time.monotonic() - self._started_at, 1e-9)
+        return {
+            "workers": self.workers,
+            "busy_workers": busy,
+            "utilisation": round(busy / self.workers, 3),
+            "utilisation_avg": round(min(1.0, self.busy_seconds / (uptime * self.workers)), 3),
+            "queue_depth": max(0, self._inflight - self.workers),
+            "queue_size": self.queue_size,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "state": self.state,
+            "avg_ms": round(1000 * self.busy_seconds / self.completed, 1) if self.completed else None,
+            "images": self.images,
+            "decode_avg_ms": round(1000 * self.decode_seconds / self.images, 1) if self.images else None,
+            "worker_peak_rss_mb": round(max((m["peak_rss_kb"] for m in self.worker_memory.values()),
+                                            default=0) / 1024, 1),
+            "microbatch": self.batcher.stats() if self.batcher is not None else None,
+        }
+
+
+class RecBatcher:
+    """
+    在 max_wait 时间窗内收集并发请求的文本行切片，凑满 batch_size 或到时即合并成一次识别任务，
+    结果再按请求切回去。
+    """
+
+    def __init__(self, engine: OCREngine, batch_size: int = OCR_REC_BATCH_SIZE,
+                 max_wait_ms: float = OCR_REC_MAX_WAIT_MS):
+        self.engine = engine
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []          # [(crops, future)]
+        self._pending_crops = 0
+        self._timer = None
+        self._tasks = set()         # 持有 _run 任务的引用，防止被回收
+        self.batches = 0
+        self.crops = 0
+
+    async def recognize(self, crops):
+        if not len(crops):
+            return []
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((crops, fut))
+        self._pending_crops += len(crops)
+
+        if self._pending_crops >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        # 识别任务本身有超时，这里再兜一层，批次出任何意外都不会让请求永远挂着
+        try:
+            return await asyncio.wait_for(fut, self.engine.timeout + self.max_wait)
+        except asyncio.TimeoutError:
+            raise OCRTimeout(f"OCR 超时（>{self.engine.timeout:g}s）") from None
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_crops = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        all_crops = [crop for crops, _ in batch for crop in crops]
+        self.batches += 1
+        self.crops += len(all_crops)
+        texts, error = None, OCRUnavailable("文本识别批次被中断")
+        try:
+            texts, elapse = await self.engine.submit(_rec_batch, all_crops, admitted=True)
+            metrics.observe("rec_batch", elapse or 0)
+        except Exception as e:
+            metrics.error("rec_batch", e)
+            error = e
+        finally:
+            # 包括任务被取消：每个等待者都要拿到结果或异常
+            start = 0
+            for crops, fut in batch:
+                if not fut.done():
+                    if texts is None:
+                        fut.set_exception(error)
+                    else:
+                        fut.set_result(texts[start:start + len(crops)])
+                start += len(crops)
+
+    def stats(self):
+        return {
+            "batch_size": self.batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "batches": self.batches,
+            "crops": self.crops,
+            "avg_batch": round(self.crops / self.batches, 1) if self.batches else None,
+        }
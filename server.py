@@ -2,23 +2,47 @@
 AI 数学老师 - 后端服务（使用 RapidOCR，无需 Tesseract）
 """
 
+# 最先记录，用于统计 import 到就绪的耗时
+import time
+IMPORT_STARTED = time.monotonic()
+
 from fastapi import FastAPI, File, UploadFile, Request
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.routing import Match
 from pydantic import BaseModel
-from PIL import Image
-import numpy as np
-import io
+from typing import List
+import asyncio
 import os
+import shutil
+import tempfile
+import zipfile
 import json
-import requests
-import webbrowser
+from datetime import datetime, timezone
 
 # ==================================================
 # 使用 RapidOCR（Render 免费实例可运行）
+# 推理放到独立进程池，避免阻塞事件循环
 # ==================================================
-from rapidocr_paddle import RapidOCR
-ocr = RapidOCR()
+from ocr_engine import OCREngine, OCRBusy, OCRTimeout, OCRUnavailable, OCR_STARTUP, preload
+from ocr_cache import OCRCache, content_key
+from image_ingest import (
+    read_upload, read_zip_entry, zip_images, is_zip, UploadTooLarge,
+    OCR_BATCH_MAX_FILES, OCR_BATCH_MAX_BYTES,
+)
+from llm_client import DeepSeekClient, SolutionCache, LLMError, normalize_problem
+from solve_stream import SolutionStreamParser, parse_solution
+from tag_engine import TagEngine
+from wrong_book import WrongBook, WrongBookFull
+import metrics
+ocr_engine = OCREngine()
+ocr_cache = OCRCache()
+wrong_book = WrongBook()
+
+# prefork：import 阶段就在父进程加载模型，之后 fork 出的进程共享内存页
+#   gunicorn server:app -k uvicorn.workers.UvicornWorker -w 2 --preload
+preload_info = preload() if OCR_STARTUP == "prefork" else None
+app_ready_at = None
 
 # ==================================================
 # FastAPI 初始化
@@ -28,6 +52,77 @@ app = FastAPI(title="AI 数学老师", version="2.0")
 # 静态文件
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# 请求日志：设置 REQUEST_LOG 后把 API 请求追加成 JSONL，供 bench.py replay 回放
+REQUEST_LOG = os.environ.get("REQUEST_LOG", "")
+
+def log_request(path: str, **fields):
+    if not REQUEST_LOG:
+        return
+    with open(REQUEST_LOG, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"ts": time.time(), "path": path, **fields}, ensure_ascii=False) + "\n")
+
+def endpoint_label(scope):
+    # 按路由模板计数；匹配不到路由的路径（404 探测等）一律归为 other，避免撑爆标签
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "other"
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    endpoint = endpoint_label(request.scope)
+    timings = []
+    metrics.request_timings.set(timings)
+    metrics.INFLIGHT.inc(endpoint)
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        # 流式接口这里只统计到响应头发出
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        metrics.INFLIGHT.dec(endpoint)
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint, status)
+    if metrics.SERVER_TIMING and timings:
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+    return response
+
+@app.on_event("startup")
+async def startup():
+    global app_ready_at
+    app_ready_at = time.monotonic()
+    # 连接在这里打开而不是 import 时：gunicorn --preload 下每个 worker 各自建连接
+    await asyncio.to_thread(wrong_book.open)
+    await asyncio.to_thread(ocr_cache.open)
+    # 旧 Node 服务留下的 wrong_book.json 一次性导入
+    try:
+        n = await asyncio.to_thread(wrong_book.import_json)
+        if n:
+            print(f"✅ 已导入 {n} 条旧错题")
+    except Exception as e:
+        print(f"❌ 旧错题导入失败：{e}")
+    if OCR_STARTUP in ("eager", "prefork"):
+        # 后台预热，/health 立即可用，/ready 等预热完成
+        app.state.warmup_task = asyncio.create_task(warm_up())
+
+async def warm_up():
+    try:
+        await ocr_engine.warm_up()
+        print(f"✅ OCR 预热完成（{OCR_STARTUP}），import 到就绪 "
+              f"{1000 * (ocr_engine.ready_at - IMPORT_STARTED):.0f} ms")
+    except Exception as e:
+        print(f"❌ OCR 预热失败：{e}")
+
+@app.on_event("shutdown")
+async def shutdown():
+    ocr_engine.shutdown()
+    ocr_cache.close()
+    wrong_book.close()
+    for task in list(stream_tasks):
+        task.cancel()
+    await llm.aclose()
+
 @app.get("/", response_class=HTMLResponse)
 async def home():
     ocr_path = "static/ocr.html"
@@ -38,26 +133,114 @@ async def home():
 # ==================================================
 # 1. OCR 识别接口（无需 Tesseract）
 # ==================================================
+async def recognize_cached(img_bytes: bytes):
+    # 内容哈希精确命中：同一文件重复上传（重试、刷新）不再排队识别
+    with metrics.timed("cache"):
+        key = content_key(img_bytes)
+        lines = await ocr_cache.get(key)
+    if lines is None:
+        lines = await ocr_engine.recognize(img_bytes)
+        ocr_cache.put(key, lines)
+    return lines
+
 @app.post("/api/ocr")
 async def ocr_image(file: UploadFile = File(...)):
     try:
-        img_bytes = await file.read()
-        image = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        img_np = np.array(image)
-
-        result, _ = ocr(img_np)
-        if not result:
-            return {"text": ""}
-
-        text = "\n".join([line[1] for line in result])
-        return {"text": text}
+        with metrics.timed("upload_read"):
+            img_bytes = await read_upload(file)
+        log_request("/api/ocr", file=file.filename, bytes=len(img_bytes))
+        lines = await recognize_cached(img_bytes)
+        return {"text": "\n".join(lines)}
 
+    except UploadTooLarge as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    except OCRBusy as e:
+        return JSONResponse(content={"error": str(e)}, status_code=429,
+                            headers={"Retry-After": str(e.retry_after)})
+    except OCRTimeout as e:
+        return JSONResponse(content={"error": str(e)}, status_code=504)
+    except OCRUnavailable as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 # ==================================================
-# 2. 数学题解析
+# 1.1 批量 OCR：多图 multipart 或 zip，逐张完成即以 NDJSON 推送
 # ==================================================
+@app.post("/api/ocr/batch")
+async def ocr_batch(files: List[UploadFile] = File(...)):
+    # 响应开始流式输出后 UploadFile 会被框架关闭：普通图片先读进来（总量有上限），
+    # zip 复制到自己管理的临时文件，条目在处理时再逐个解压
+    jobs, temps, total = [], [], 0
+    try:
+        for file in files:
+            if is_zip(file):
+                tmp = tempfile.TemporaryFile()
+                temps.append(tmp)
+                await asyncio.to_thread(shutil.copyfileobj, file.file, tmp)
+                total += tmp.tell()
+                zf = zipfile.ZipFile(tmp)
+                jobs += [(info.filename, zf, info) for info in zip_images(zf)]
+            else:
+                img_bytes = await read_upload(file)
+                total += len(img_bytes)
+                jobs.append((file.filename, None, img_bytes))
+
+            if total > OCR_BATCH_MAX_BYTES:
+                raise UploadTooLarge(f"批量上传过大（>{OCR_BATCH_MAX_BYTES // (1024 * 1024)}MB）")
+            if len(jobs) > OCR_BATCH_MAX_FILES:
+                raise UploadTooLarge(f"单次最多 {OCR_BATCH_MAX_FILES} 张图片")
+    except (UploadTooLarge, zipfile.BadZipFile) as e:
+        for tmp in temps:
+            tmp.close()
+        status = 413 if isinstance(e, UploadTooLarge) else 400
+        return JSONResponse(content={"error": str(e)}, status_code=status)
+
+    # 一个批次最多同时占满所有 worker，不抢占队列里其他用户的名额
+    sem = asyncio.Semaphore(ocr_engine.workers)
+
+    async def run(index, name, zf, payload):
+        async with sem:
+            try:
+                # 解压最多 OCR_MAX_UPLOAD_BYTES，放到线程里做
+                img_bytes = payload if zf is None else await asyncio.to_thread(read_zip_entry, zf, payload)
+                for attempt in range(3):
+                    try:
+                        lines = await recognize_cached(img_bytes)
+                        break
+                    except OCRBusy as e:
+                        if attempt == 2:
+                            raise
+                        await asyncio.sleep(min(e.retry_after, 5))
+                return {"index": index, "name": name, "text": "\n".join(lines)}
+            except Exception as e:
+                return {"index": index, "name": name, "error": str(e)}
+
+    async def stream():
+        tasks = [asyncio.create_task(run(i, name, zf, payload))
+                 for i, (name, zf, payload) in enumerate(jobs)]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield json.dumps(await done, ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True, "count": len(jobs)}) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            for tmp in temps:
+                tmp.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/api/ocr/stats")
+async def ocr_stats():
+    return {**ocr_engine.stats(), "cache": ocr_cache.stats()}
+
+# ==================================================
+# 2. 数学题解析（知识点题库见 knowledge_tags.json，启动时编译一次）
+# ==================================================
+tag_engine = TagEngine.load()
+PARSE_BATCH_MAX = int(os.environ.get("PARSE_BATCH_MAX", 10000))
+
 @app.post("/api/parse")
 async def parse_question(request: Request):
     data = await request.json()
@@ -65,23 +248,44 @@ async def parse_question(request: Request):
 
     if not question:
         return JSONResponse({"error": "缺少 text 字段"}, status_code=400)
+    log_request("/api/parse", body={"text": question})
 
-    tags = []
-    if "f(x)" in question or "函数" in question:
-        tags = ["函数-单调性", "二次函数"]
-    elif "导数" in question:
-        tags = ["导数-求导", "导数-极值"]
-    else:
-        tags = ["基础识别"]
+    with metrics.timed("tag"):
+        scores = tag_engine.score(question)
+    tags = tag_engine.names(scores)
 
     return {
         "success": True,
         "parsed": {
             "question": question,
-            "knowledge_tags": tags
+            "knowledge_tags": tags,
+            "tag_scores": scores
         }
     }
 
+@app.post("/api/parse/batch")
+async def parse_batch(request: Request):
+    data = await request.json()
+    texts = data.get("texts")
+    if not isinstance(texts, list):
+        return JSONResponse({"error": "缺少 texts 数组"}, status_code=400)
+    if len(texts) > PARSE_BATCH_MAX:
+        return JSONResponse({"error": f"单次最多 {PARSE_BATCH_MAX} 题"}, status_code=413)
+
+    # 几千题是纯 CPU 计算，放线程里跑，避免一次性占住事件循环
+    t0 = time.perf_counter()
+    with metrics.timed("tag_batch"):
+        all_scores = await asyncio.to_thread(tag_engine.tag_many, [str(t or "") for t in texts])
+    elapsed = time.perf_counter() - t0
+
+    results = [{
+        "index": i,
+        "knowledge_tags": tag_engine.names(scores),
+        "tag_scores": scores,
+    } for i, scores in enumerate(all_scores)]
+    return {"success": True, "count": len(results), "elapsed_ms": round(1000 * elapsed, 1),
+            "results": results}
+
 # ==================================================
 # 3. 调用 DeepSeek AI 求解数学题
 # ==================================================
@@ -89,59 +293,237 @@ class SolveReq(BaseModel):
     problem: str
     level: str = "高中"
 
-DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+llm = DeepSeekClient()
+solutions = SolutionCache()
 
+# 模板里的 JSON 花括号需要转义，否则 str.format 会把它当成占位符
 PROMPT_TEMPLATE = """
 你是高中数学教练。严格输出 JSON。
-{
+{{
   "problem": "<原题>",
   "final_answer": "<最终答案>",
   "steps": [
-    {"step":"1","content":"步骤描述","explain":"解释"},
-    {"step":"2","content":"...","explain":"..."}
+    {{"step":"1","content":"步骤描述","explain":"解释"}},
+    {{"step":"2","content":"...","explain":"..."}}
   ],
   "why": "<方法总结>",
   "similar": ["同类题1","同类题2"]
-}
+}}
 题目：{problem}
 难度：{level}
 """
 
-def call_deepseek(prompt: str):
-    if not DEEPSEEK_API_KEY:
-        raise Exception("缺少 DEEPSEEK_API_KEY 环境变量")
-
-    url = "https://api.deepseek.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": "deepseek-chat",
-        "messages": [{"role": "user", "content": prompt}],
-    }
-
-    r = requests.post(url, json=payload, headers=headers)
-    data = r.json()
-
-    return data["choices"][0]["message"]["content"]
+async def call_deepseek(prompt: str):
+    with metrics.timed("deepseek"):
+        output = await llm.chat(prompt)
+    with metrics.timed("solution_parse"):
+        result = parse_solution(output)
+    if result.get("truncated"):
+        raise ValueError("模型输出被截断")
+    return result
 
 @app.post("/api/solve")
 async def solve(req: SolveReq):
+    log_request("/api/solve", body=req.dict())
     try:
         prompt = PROMPT_TEMPLATE.format(problem=req.problem, level=req.level)
-        output = call_deepseek(prompt)
-        return json.loads(output)
+        key = (normalize_problem(req.problem), req.level)
+        return await solutions.get_or_compute(key, lambda: call_deepseek(prompt))
     except Exception as e:
         return {"error": str(e)}
 
 # ==================================================
-# 健康检查
+# 3.1 流式求解（SSE）：每完成一个步骤就推给前端
+# ==================================================
+def sse(event: str, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def replay_events(result):
+    for key, value in result.items():
+        if key == "steps":
+            for step in value:
+                yield sse("step", step)
+        else:
+            yield sse(key, value)
+
+stream_tasks = set()      # 进行中的上游流任务，持有引用防止被回收
+
+async def stream_solution(prompt, fut, events: asyncio.Queue):
+    """读上游流、逐个解析出 SSE 事件放进 events（结束放 None），最终结果写入 fut"""
+    parser = SolutionStreamParser()
+    t0 = first = time.perf_counter()
+    try:
+        try:
+            async for delta in llm.stream_chat(prompt):
+                if first == t0:
+                    first = time.perf_counter()
+                    metrics.observe("deepseek_ttfb", first - t0)
+                for name, value in parser.feed(delta):
+                    events.put_nowait(sse(name, value))
+            result = parser.finish()
+        except Exception as e:
+            metrics.error("deepseek_stream", e)
+            fut.set_exception(e)
+            events.put_nowait(sse("error", {"error": str(e)}))
+            return
+        metrics.observe("deepseek_stream", time.perf_counter() - t0)
+
+        # 截断的结果照常返回已完成部分，但不进缓存，也不分给合并进来的请求
+        if result.get("truncated"):
+            fut.set_exception(ValueError("模型输出被截断"))
+        else:
+            fut.set_result(result)
+        events.put_nowait(sse("done", result))
+    finally:
+        # 任务被取消（应用关闭）时，不能让等待同题结果的请求一直挂着
+        if not fut.done():
+            fut.set_exception(LLMError("上游请求已中断"))
+        events.put_nowait(None)
+
+@app.post("/api/solve/stream")
+async def solve_stream(req: SolveReq):
+    log_request("/api/solve/stream", body=req.dict())
+    key = (normalize_problem(req.problem), req.level)
+    prompt = PROMPT_TEMPLATE.format(problem=req.problem, level=req.level)
+
+    async def stream():
+        state, value = solutions.claim(key)
+        if state != "lead":
+            # 命中缓存，或同一道题已有请求在途：等它的结果整体回放
+            try:
+                result = value if state == "hit" else await asyncio.shield(value)
+            except Exception as e:
+                yield sse("error", {"error": str(e)})
+                return
+            for event in replay_events(result):
+                yield event
+            yield sse("done", result)
+            return
+
+        # 上游流在独立任务里跑：客户端断开只结束这个生成器，合并进来的请求照样拿到结果
+        events = asyncio.Queue()
+        task = asyncio.create_task(stream_solution(prompt, value, events))
+        stream_tasks.add(task)
+        task.add_done_callback(stream_tasks.discard)
+        while (event := await events.get()) is not None:
+            yield event
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/solve/stats")
+async def solve_stats():
+    return {**llm.stats(), "cache": solutions.stats()}
+
+# ==================================================
+# 错题本：只追加写入，按学生/知识点分页查询
+# ==================================================
+@app.post("/api/wrong")
+async def save_wrong(request: Request):
+    try:
+        record = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "请求体不是合法 JSON"}, status_code=400)
+    if not isinstance(record, dict):
+        return JSONResponse({"error": "错题记录必须是对象"}, status_code=400)
+
+    # 与 server.js 一致：时间以服务端保存时刻为准
+    record["time"] = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    tags = record.get("knowledge_tags")
+    if isinstance(tags, str):
+        record["knowledge_tags"] = [tags]
+    elif tags is not None and not isinstance(tags, list):
+        return JSONResponse({"error": "knowledge_tags 必须是字符串数组"}, status_code=400)
+    if tags is None:
+        question = record.get("question") or record.get("text") or ""
+        if question:
+            record["knowledge_tags"] = tag_engine.tag(str(question))
+
+    try:
+        with metrics.timed("wrong_book_save"):
+            entry_id = await wrong_book.add(record)
+    except WrongBookFull as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=503,
+                            headers={"Retry-After": "1"})
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+    return {"success": True, "message": "saved", "id": entry_id}
+
+# 兼容旧前端直接调用 Node 版 /save_wrong
+app.post("/save_wrong")(save_wrong)
+
+@app.get("/api/wrong")
+async def list_wrong(student: str = None, tag: str = None, limit: int = 20, cursor: str = None):
+    try:
+        return await asyncio.to_thread(wrong_book.list, student, tag, limit, cursor)
+    except (ValueError, UnicodeDecodeError):
+        return JSONResponse({"error": "cursor 无效"}, status_code=400)
+
+@app.get("/api/wrong/tags/top")
+async def top_wrong_tags(student: str = None, days: float = None, limit: int = 10):
+    since = time.time() - days * 86400 if days else None
+    return {"tags": await asyncio.to_thread(wrong_book.top_tags, student, since, limit)}
+
+@app.get("/api/wrong/stats")
+async def wrong_stats():
+    return wrong_book.stats()
+
+# ==================================================
+# Prometheus 指标
+# ==================================================
+@metrics.registry.collector
+def runtime_metrics():
+    engine = ocr_engine.stats()
+    cache = ocr_cache.stats()
+    solve_cache = solutions.stats()
+    client = llm.stats()
+    yield "mathocr_ocr_workers", "gauge", "OCR worker 进程数", {}, engine["workers"]
+    yield "mathocr_ocr_busy_workers", "gauge", "正在执行任务的 OCR worker 数", {}, engine["busy_workers"]
+    yield "mathocr_ocr_queue_depth", "gauge", "排队等待的 OCR 任务数", {}, engine["queue_depth"]
+    for outcome in ("completed", "failed", "rejected", "timeouts"):
+        yield "mathocr_ocr_jobs_total", "counter", "OCR 任务结果计数", {"outcome": outcome}, engine[outcome]
+    yield "mathocr_ocr_pool_restarts_total", "counter", "OCR 进程池重建次数", {}, engine["restarts"]
+    for name in ("hits_memory", "hits_disk", "misses", "evictions"):
+        yield "mathocr_ocr_cache_events_total", "counter", "OCR 缓存事件计数", {"event": name}, cache[name]
+    yield "mathocr_ocr_cache_bytes", "gauge", "OCR 内存缓存占用字节", {}, cache["bytes"]
+    for name in ("hits", "misses", "coalesced"):
+        yield "mathocr_solve_cache_events_total", "counter", "解答缓存事件计数", {"event": name}, solve_cache[name]
+    for name in ("requests", "retries", "errors"):
+        yield "mathocr_deepseek_calls_total", "counter", "DeepSeek 调用计数", {"kind": name}, client[name]
+    book = wrong_book.stats()
+    yield "mathocr_wrong_book_queue_depth", "gauge", "等待提交的错题写入数", {}, book["queue"]
+    yield "mathocr_wrong_book_commits_total", "counter", "错题本批量提交次数", {}, book["commits"]
+    yield "mathocr_wrong_book_written_total", "counter", "错题本已写入条数", {}, book["written"]
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# ==================================================
+# 健康检查：/health 只看进程存活，/ready 看 OCR 能否马上干活
 # ==================================================
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+def since_import_ms(t):
+    return None if t is None else round(1000 * (t - IMPORT_STARTED), 1)
+
+@app.get("/ready")
+async def ready():
+    # lazy 模式按需加载，应用起来就算就绪
+    ok = ocr_engine.state == "ready" or (OCR_STARTUP == "lazy" and ocr_engine.state != "failed")
+    info = {
+        "ready": ok,
+        "mode": OCR_STARTUP,
+        "ocr": ocr_engine.state,
+        "import_to_app_ready_ms": since_import_ms(app_ready_at),
+        "import_to_ocr_ready_ms": since_import_ms(ocr_engine.ready_at),
+        "parent": preload_info,
+        "workers": list(ocr_engine.worker_memory.values()),
+    }
+    return JSONResponse(info, status_code=200 if ok else 503)
+
 # ==================================================
 # 本地调试
 # ==================================================
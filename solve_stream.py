@@ -0,0 +1,134 @@
+"""
+解答 JSON 增量解析：边接收模型输出边切出 PROMPT_TEMPLATE 里的各个字段
+
+- 第一个 "{" 之前、顶层 "}" 之后的内容（```json 围栏、说明文字）直接忽略
+- steps 数组每完成一项就产出一个 step 事件，其余顶层字段完成即产出同名事件
+- 输出被截断时用已完成的字段拼出结果，不需要重新请求
+"""
+
+import json
+
+
+class _Frame:
+    __slots__ = ("kind", "key", "expect", "vstart")
+
+    def __init__(self, kind):
+        self.kind = kind          # "{" 或 "["
+        self.key = None           # 对象里当前的键
+        self.expect = "key"       # 对象里下一个 token 是键还是值
+        self.vstart = None        # 当前子值在缓冲区里的起点
+
+
+class SolutionStreamParser:
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.stack = []
+        self.in_str = False
+        self.str_is_key = False
+        self.str_start = 0
+        self.esc = False
+        self.closed = False
+        self.result = {}
+        self.steps = []
+
+    def feed(self, chunk: str):
+        """追加一段文本，返回这段文本里新完成的 [(事件名, 值)]"""
+        self.buf += chunk
+        events = []
+        buf = self.buf
+
+        while self.pos < len(buf) and not self.closed:
+            i = self.pos
+            c = buf[i]
+            self.pos += 1
+
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif c == "\\":
+                    self.esc = True
+                elif c == '"':
+                    self.in_str = False
+                    frame = self.stack[-1]
+                    if self.str_is_key:
+                        frame.key = json.loads(buf[self.str_start:i + 1])
+                    else:
+                        self._complete(frame, i + 1, events)
+                continue
+
+            if not self.stack:
+                if c == "{":
+                    self.stack.append(_Frame("{"))
+                continue
+
+            frame = self.stack[-1]
+            if c.isspace():
+                continue
+
+            if c == '"':
+                self.in_str = True
+                self.str_start = i
+                self.str_is_key = frame.kind == "{" and frame.expect == "key"
+                if not self.str_is_key and frame.vstart is None:
+                    frame.vstart = i
+            elif c == ":":
+                frame.expect = "value"
+            elif c == ",":
+                if frame.vstart is not None:          # 数字 / true / false / null
+                    self._complete(frame, i, events)
+                frame.expect = "key"
+            elif c in "}]":
+                if frame.vstart is not None:
+                    self._complete(frame, i, events)
+                self.stack.pop()
+                if not self.stack:
+                    self.closed = True
+                else:
+                    self._complete(self.stack[-1], i + 1, events)
+            elif c in "{[":
+                if frame.vstart is None:
+                    frame.vstart = i
+                self.stack.append(_Frame(c))
+            elif frame.vstart is None:
+                frame.vstart = i
+
+        return events
+
+    def _complete(self, frame, end, events):
+        text = self.buf[frame.vstart:end]
+        frame.vstart = None
+        try:
+            value = json.loads(text)
+        except ValueError:
+            return
+
+        depth = len(self.stack)
+        if depth == 1 and frame.key is not None:
+            self.result[frame.key] = value
+            if frame.key != "steps":
+                events.append((frame.key, value))
+        elif depth == 2 and frame.kind == "[" and self.stack[0].key == "steps":
+            self.steps.append(value)
+            events.append(("step", value))
+
+    def finish(self):
+        """
+        流结束后取完整结果。没有找到 JSON 时抛 ValueError；
+        被截断时返回已完成的字段，并标记 truncated。
+        """
+        if not self.stack and not self.closed:
+            raise ValueError(f"模型未返回 JSON：{self.buf[:200]}")
+
+        result = dict(self.result)
+        if not self.closed:
+            result.setdefault("steps", self.steps)
+            result["truncated"] = True
+        return result
+
+
+def parse_solution(output: str):
+    """一次性解析完整输出，兼容围栏和截断"""
+    parser = SolutionStreamParser()
+    parser.feed(output)
+    return parser.finish()
@@ -0,0 +1,129 @@
+"""
+知识点打标引擎：从 knowledge_tags.json 读取关键词/正则题库，编译成 Aho-Corasick 自动机，
+一遍扫描文本即可得到全部命中的知识点及得分
+"""
+
+import json
+import os
+import re
+import unicodedata
+from collections import deque
+
+TAG_TAXONOMY = os.environ.get(
+    "TAG_TAXONOMY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_tags.json"))
+
+# NFKC 之前先处理：上标指数要保留成 ^2，不能被折成普通数字；中文排版常见的几种符号统一
+_PRE = str.maketrans({"²": "^2", "³": "^3", "≧": "≥", "≦": "≤", "′": "'", "’": "'", "‘": "'"})
+_SPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """全角转半角、统一大小写和符号、去掉空白，关键词和题目用同一套规则"""
+    return _SPACE.sub("", unicodedata.normalize("NFKC", text.translate(_PRE)).casefold())
+
+
+class AhoCorasick:
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for wid, word in enumerate(words):
+            self._add(word, wid)
+        self._build()
+
+    def _add(self, word, wid):
+        node = 0
+        for ch in word:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            node = nxt
+        self.out[node] += (wid,)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                # 沿失败链的输出提前合并，扫描时不用再回溯
+                self.out[nxt] += self.out[self.fail[nxt]]
+                queue.append(nxt)
+
+    def find(self, text):
+        """返回文本中出现过的词编号集合"""
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+class TagEngine:
+    def __init__(self, taxonomy: dict):
+        self.fallback = taxonomy.get("fallback")
+        self.min_score = float(taxonomy.get("min_score", 0))
+        self.tags = [entry["tag"] for entry in taxonomy["tags"]]
+
+        # 同一个关键词可能属于多个知识点：词 -> [(知识点下标, 权重)]
+        words = {}
+        patterns = []
+        for idx, entry in enumerate(taxonomy["tags"]):
+            for word, weight in entry.get("keywords", {}).items():
+                words.setdefault(normalize(word), []).append((idx, float(weight)))
+            for pattern, weight in entry.get("patterns", {}).items():
+                patterns.append((pattern, idx, float(weight)))
+
+        self.words = list(words)
+        self.word_tags = [words[w] for w in self.words]
+        self.automaton = AhoCorasick(self.words)
+
+        # 每个正则单独 search：合并成一个交替式时 finditer 只给最左、互不重叠的匹配，
+        # 与前一个匹配重叠的正则会被漏掉（如 "0<a_{n+1}" 里的不等号吃掉了数列下标的 a）
+        self.patterns = [(re.compile(p), idx, weight) for p, idx, weight in patterns]
+
+    @classmethod
+    def load(cls, path: str = TAG_TAXONOMY):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def score(self, text: str):
+        """返回 [{"tag", "score"}]，按得分从高到低；每个关键词/正则只计一次"""
+        norm = normalize(text)
+        scores = {}
+        for wid in self.automaton.find(norm):
+            for idx, weight in self.word_tags[wid]:
+                scores[idx] = scores.get(idx, 0.0) + weight
+
+        for regex, idx, weight in self.patterns:
+            if regex.search(norm):
+                scores[idx] = scores.get(idx, 0.0) + weight
+
+        ranked = sorted(((s, idx) for idx, s in scores.items() if s >= self.min_score),
+                        key=lambda x: (-x[0], x[1]))
+        return [{"tag": self.tags[idx], "score": round(s, 2)} for s, idx in ranked]
+
+    def names(self, scores):
+        """score() 结果转成知识点名称；一个都没命中时给 fallback"""
+        names = [item["tag"] for item in scores]
+        if not names and self.fallback:
+            names = [self.fallback]
+        return names
+
+    def tag(self, text: str):
+        return self.names(self.score(text))
+
+    def tag_many(self, texts):
+        return [self.score(text) for text in texts]
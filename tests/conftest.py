@@ -0,0 +1,45 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def deepseek_stub():
+    """启动 deepseek_stub.py，返回 start(**env) -> base_url；测试结束自动关闭"""
+    import httpx
+
+    procs = []
+
+    def start(**env):
+        port = _free_port()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "deepseek_stub:app", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT, env={**os.environ, "STUB_LATENCY_MS": "50", **{k: str(v) for k, v in env.items()}},
+        )
+        procs.append(proc)
+        base_url = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                httpx.get(base_url + "/stats", timeout=0.5)
+                return base_url
+            except httpx.TransportError:
+                time.sleep(0.1)
+        raise RuntimeError("deepseek_stub 启动失败")
+
+    yield start
+    for proc in procs:
+        proc.terminate()
+        proc.wait(timeout=10)
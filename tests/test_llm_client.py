@@ -0,0 +1,174 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from llm_client import DeepSeekClient, LLMError, SolutionCache
+
+
+def _client(base_url, **kwargs):
+    client = DeepSeekClient(api_key="stub", base_url=base_url, **kwargs)
+    client._backoff = lambda attempt, retry_after=None: 0.01
+    return client
+
+
+def _stub_calls(base_url):
+    return httpx.get(base_url + "/stats").json()
+
+
+def test_chat_against_stub(deepseek_stub):
+    base_url = deepseek_stub()
+
+    async def main():
+        client = _client(base_url)
+        try:
+            return await client.chat("题目：x^2-3x+2=0")
+        finally:
+            await client.aclose()
+
+    assert '"final_answer"' in asyncio.run(main())
+
+
+def test_retries_on_stub_failures(deepseek_stub):
+    base_url = deepseek_stub(STUB_FAIL_RATE=0.3)
+
+    async def main():
+        client = _client(base_url, max_retries=10)
+        try:
+            results = await asyncio.gather(*[client.chat(f"题目：{i}") for i in range(20)])
+        finally:
+            await client.aclose()
+        return client, results
+
+    client, results = asyncio.run(main())
+    calls = _stub_calls(base_url)
+    assert len(results) == 20
+    assert client.errors == 0
+    assert client.retries == calls["failed"]
+    assert client.requests == calls["total"]
+
+
+def test_gives_up_after_max_retries(deepseek_stub):
+    base_url = deepseek_stub(STUB_FAIL_RATE=1)
+
+    async def main():
+        client = _client(base_url, max_retries=2)
+        try:
+            with pytest.raises(LLMError) as exc:
+                await client.chat("题目：1")
+        finally:
+            await client.aclose()
+        return exc.value
+
+    assert asyncio.run(main()).status == 503
+    assert _stub_calls(base_url)["total"] == 3
+
+
+def test_coalesces_identical_requests(deepseek_stub):
+    base_url = deepseek_stub()
+
+    async def main():
+        client = _client(base_url)
+        cache = SolutionCache()
+        try:
+            results = await asyncio.gather(*[
+                cache.get_or_compute("same", lambda: client.chat("题目：同一道题")) for _ in range(10)])
+            again = await cache.get_or_compute("same", lambda: client.chat("题目：同一道题"))
+        finally:
+            await client.aclose()
+        return cache, results, again
+
+    cache, results, again = asyncio.run(main())
+    assert len(set(results)) == 1 and again == results[0]
+    assert _stub_calls(base_url)["total"] == 1
+    assert (cache.misses, cache.coalesced, cache.hits) == (1, 9, 1)
+
+
+def test_cache_ttl_expiry():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        cache = SolutionCache(ttl=0.1)
+        first = await cache.get_or_compute("k", compute)
+        hit = await cache.get_or_compute("k", compute)
+        await asyncio.sleep(0.15)
+        expired = await cache.get_or_compute("k", compute)
+        return first, hit, expired, cache
+
+    first, hit, expired, cache = asyncio.run(main())
+    assert (first, hit, expired) == (1, 1, 2)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_failures_are_not_cached():
+    async def boom():
+        raise LLMError("upstream down", status=503)
+
+    async def main():
+        cache = SolutionCache()
+        with pytest.raises(LLMError):
+            await cache.get_or_compute("k", boom)
+        return cache.get("k")
+
+    assert asyncio.run(main()) is None
+
+
+def _mock_client(handler, **kwargs):
+    client = DeepSeekClient(api_key="test", base_url="http://deepseek.test", **kwargs)
+    client._client = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    return client
+
+
+def _ok(text="ok"):
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+def test_retries_connection_reset():
+    attempts = []
+
+    def handler(request):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise httpx.ReadError("connection reset by peer", request=request)
+        return _ok()
+
+    async def main():
+        client = _mock_client(handler)
+        client._backoff = lambda attempt, retry_after=None: 0
+        try:
+            return await client.chat("hi"), client.retries
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(main()) == ("ok", 1)
+
+
+def test_backoff_does_not_hold_concurrency_slot():
+    # 并发上限 1：第一个请求收到 429 + Retry-After 退避时，第二个请求不应被挡住
+    async def handler(request):
+        if b"slow" in request.content and not handler.throttled:
+            handler.throttled = True
+            return httpx.Response(429, headers={"Retry-After": "1"})
+        return _ok()
+    handler.throttled = False
+
+    async def main():
+        client = _mock_client(handler, max_concurrency=1)
+        try:
+            slow = asyncio.create_task(client.chat("slow"))
+            await asyncio.sleep(0.05)
+            t0 = time.monotonic()
+            fast = await client.chat("fast")
+            fast_elapsed = time.monotonic() - t0
+            return fast, fast_elapsed, await slow
+        finally:
+            await client.aclose()
+
+    fast, fast_elapsed, slow = asyncio.run(main())
+    assert (fast, slow) == ("ok", "ok")
+    assert fast_elapsed < 0.5
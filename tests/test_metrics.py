@@ -0,0 +1,69 @@
+import metrics
+from metrics import Counter, Histogram, Registry
+
+
+def _lines(registry):
+    return registry.render().splitlines()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    hist = registry.register(Histogram("t_seconds", "测试", labels=("stage",), buckets=(0.1, 1.0)))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        hist.observe(value, "ocr")
+
+    assert _lines(registry) == [
+        "# HELP t_seconds 测试",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{stage="ocr",le="0.1"} 2',     # le 含边界
+        't_seconds_bucket{stage="ocr",le="1.0"} 3',
+        't_seconds_bucket{stage="ocr",le="+Inf"} 4',
+        't_seconds_sum{stage="ocr"} 3.65',
+        't_seconds_count{stage="ocr"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    counter = registry.register(Counter("t_total", "测试", labels=("error",)))
+    counter.inc('say "hi"\\\nbye')
+    assert _lines(registry)[-1] == 't_total{error="say \\"hi\\"\\\\\\nbye"} 1'
+
+
+def test_collectors_skip_none_and_share_help():
+    registry = Registry()
+    registry.collector(lambda: [
+        ("t_events_total", "counter", "事件", {"event": "hit"}, 3),
+        ("t_events_total", "counter", "事件", {"event": "miss"}, 1),
+        ("t_avg_ms", "gauge", "平均", {}, None),
+    ])
+    assert _lines(registry) == [
+        "# HELP t_events_total 事件",
+        "# TYPE t_events_total counter",
+        't_events_total{event="hit"} 3',
+        't_events_total{event="miss"} 1',
+    ]
+
+
+def test_server_timing_merges_repeated_stages():
+    header = metrics.server_timing([("cache", 0.0012), ("ocr_job", 0.25), ("cache", 0.0008)])
+    assert header == "cache;dur=2.0, ocr_job;dur=250.0"
+
+
+def test_middleware_labels_and_server_timing(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import server
+
+    monkeypatch.setattr(metrics, "SERVER_TIMING", True)
+    client = TestClient(server.app)
+
+    resp = client.post("/api/parse", json={"text": "解方程 x^2-3x+2=0"})
+    assert resp.status_code == 200
+    assert resp.headers["Server-Timing"].startswith("tag;dur=")
+
+    for path in ("/no/such/path", "/api/wrong/../../etc/passwd"):
+        assert client.get(path).status_code == 404
+    endpoints = {labels[0] for labels in metrics.REQUEST_SECONDS.values}
+    assert "/api/parse" in endpoints and "other" in endpoints
+    assert not any("no/such" in e or "passwd" in e for e in endpoints)
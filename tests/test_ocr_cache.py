@@ -0,0 +1,78 @@
+import asyncio
+import io
+
+from PIL import Image, ImageDraw
+
+from ocr_cache import OCRCache, _entry_size, content_key
+
+
+def _sheet(lines, quality=90, scale=1.0):
+    image = Image.new("L", (600, 800), 255)
+    draw = ImageDraw.Draw(image)
+    for i, text in enumerate(lines):
+        draw.text((40, 40 + 70 * i), text, fill=0)
+    if scale != 1.0:
+        image = image.resize((int(600 * scale), int(800 * scale)))
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def test_lru_evicts_oldest_by_bytes():
+    lines = ["x" * 100]
+    cache = OCRCache(max_bytes=3 * _entry_size(lines), db_path="")
+
+    async def main():
+        for key in "abc":
+            cache.put(key, lines)
+        assert await cache.get("a") == lines   # a 变成最近使用
+        cache.put("d", lines)
+        return [await cache.get(key) for key in "abcd"]
+
+    assert asyncio.run(main()) == [lines, None, lines, lines]
+    assert cache.counters["evictions"] == 1
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_no_connection_until_opened(tmp_path):
+    path = tmp_path / "lazy.db"
+    cache = OCRCache(db_path=str(path))
+    assert not path.exists() and not cache.stats()["disk"]
+    cache.open()
+    assert path.exists() and cache.stats()["disk"]
+    cache.close()
+
+
+def test_disk_round_trip(tmp_path):
+    path = str(tmp_path / "ocr_cache.db")
+    cache = OCRCache(max_bytes=0, db_path=path)
+    cache.open()
+    cache.put("k1", ["第一行", "x^2-3x+2=0"])
+    cache.close()
+
+    cache = OCRCache(max_bytes=1024, db_path=path)
+    cache.open()
+    try:
+        assert asyncio.run(cache.get("k1")) == ["第一行", "x^2-3x+2=0"]
+        assert cache.counters["hits_disk"] == 1
+        assert asyncio.run(cache.get("k1")) and cache.counters["hits_memory"] == 1
+    finally:
+        cache.close()
+
+
+def test_near_duplicates_are_not_served():
+    cache = OCRCache(max_bytes=1024 * 1024, db_path="")
+    lines = [f"{i + 1}. solve x^2-{i}x+{i + 1}=0" for i in range(10)]
+    original = _sheet(lines)
+    cache.put(content_key(original), lines)
+
+    # 同版式、只改一行的另一张试卷不能拿到别人的结果
+    changed = lines[:4] + ["5. solve x^2-9x+1=0"] + lines[5:]
+    # 同一张图重新压缩、缩放后内容哈希不同，也按未命中处理（重新识别，不会出错）
+    reencoded = _sheet(lines, quality=70, scale=0.8)
+
+    async def main():
+        return [await cache.get(content_key(img)) for img in (original, _sheet(changed), reencoded)]
+
+    assert asyncio.run(main()) == [lines, None, None]
+    assert cache.counters["misses"] == 2
@@ -0,0 +1,202 @@
+import asyncio
+import os
+import sys
+import time
+import types
+
+import pytest
+
+import ocr_engine
+from ocr_engine import OCRBusy, OCREngine, OCRTimeout, OCRUnavailable
+
+
+class _StubRapidOCR:
+    def __init__(self):
+        if os.environ.get("STUB_OCR_FAIL") == "1":
+            raise RuntimeError("模型文件缺失")
+
+
+@pytest.fixture(autouse=True)
+def stub_rapidocr(monkeypatch):
+    # 不依赖 RapidOCR：worker 由 fork 继承这个假模块
+    module = types.ModuleType("rapidocr_paddle")
+    module.RapidOCR = _StubRapidOCR
+    monkeypatch.setitem(sys.modules, "rapidocr_paddle", module)
+    monkeypatch.setattr(ocr_engine, "_ocr", None)
+
+
+@pytest.fixture
+def make_engine():
+    engines = []
+
+    def make(**kwargs):
+        engine = OCREngine(mode="lazy", **kwargs)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        pool = engine._pool
+        engine.shutdown()
+        for p in list((getattr(pool, "_processes", None) or {}).values()):
+            p.kill()
+
+
+def sleep_job(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def test_rejects_when_capacity_is_full(make_engine):
+    engine = make_engine(workers=1, queue_size=1, timeout=5)
+
+    async def main():
+        jobs = [asyncio.create_task(engine.submit(sleep_job, 0.3)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(OCRBusy) as e:
+            await engine.submit(sleep_job, 0)
+        assert e.value.retry_after >= 1
+        await asyncio.gather(*jobs)
+        return await engine.submit(sleep_job, 0)
+
+    assert asyncio.run(main())
+    assert engine.rejected == 1 and engine.completed == 3
+
+
+def test_timeout_keeps_slot_until_child_finishes(make_engine):
+    engine = make_engine(workers=1, queue_size=0, timeout=0.3, kill_after=10)
+
+    async def main():
+        await engine.submit(sleep_job, 0)        # 先把进程池拉起来
+        with pytest.raises(OCRTimeout):
+            await engine.submit(sleep_job, 1.0)
+        # 子进程还在跑，名额不能放
+        assert engine._inflight == 1
+        with pytest.raises(OCRBusy):
+            await engine.submit(sleep_job, 0)
+        await asyncio.sleep(1.0)
+        assert engine._inflight == 0
+        return await engine.submit(sleep_job, 0)
+
+    assert asyncio.run(main())
+    assert engine.timeouts == 1 and engine.restarts == 0
+
+
+def test_hung_worker_is_replaced_and_queued_jobs_resubmitted(make_engine):
+    engine = make_engine(workers=1, queue_size=4, timeout=1.0, kill_after=0.2)
+
+    async def main():
+        first = await engine.submit(sleep_job, 0)
+        hung = asyncio.create_task(engine.submit(sleep_job, 60))
+        await asyncio.sleep(0.7)
+        # 排在卡死任务后面的请求：进程池重建时被取消或杀掉，应换到新池完成
+        queued = [asyncio.create_task(engine.submit(sleep_job, 0)) for _ in range(3)]
+        with pytest.raises(OCRTimeout):
+            await hung
+        pids = await asyncio.gather(*queued)
+        return first, pids
+
+    first, pids = asyncio.run(main())
+    assert engine.restarts == 1
+    assert first not in pids
+    assert engine._inflight == 0
+
+
+def test_model_load_failure_marks_engine_failed(make_engine, monkeypatch):
+    monkeypatch.setenv("STUB_OCR_FAIL", "1")
+    engine = make_engine(workers=2, queue_size=2, timeout=5)
+
+    async def main():
+        for _ in range(3):
+            with pytest.raises(OCRUnavailable):
+                await engine.submit(sleep_job, 0)
+
+    asyncio.run(main())
+    # 不会反复重建进程池，状态置为 failed 供 /ready 返回 503
+    assert engine.state == "failed"
+    assert engine.restarts == 0
+    assert engine._pool is None
+
+
+# ---------- 微批识别 ----------
+class _StubPipeline:
+    """按 20px 一条横带检测文本行，识别结果是切片的平均灰度"""
+    text_score = 0.5
+
+    def text_det(self, img):
+        boxes = [[[0, y], [img.shape[1], y], [img.shape[1], y + 20], [0, y + 20]]
+                 for y in range(0, img.shape[0], 20)]
+        return boxes, 0.001
+
+    def text_cls(self, crops):
+        return crops, None, 0.001
+
+    def text_rec(self, crops):
+        # 灰度 0 的切片给低分，应被置空丢弃
+        return [(str(int(crop.mean())), 0.9 if crop.mean() else 0.1) for crop in crops], 0.001
+
+
+def _axis_crop(img, points):
+    (x0, y0), (x1, y1) = points[0], points[2]
+    return img[y0:y1, x0:x1]
+
+
+def _bands(*values):
+    import io
+
+    from PIL import Image
+
+    image = Image.new("L", (60, 20 * len(values)))
+    for i, value in enumerate(values):
+        image.paste(value, (0, 20 * i, 60, 20 * (i + 1)))
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_microbatch_splits_results_back_per_request(make_engine, monkeypatch):
+    monkeypatch.setattr(ocr_engine, "_ocr", _StubPipeline())
+    monkeypatch.setattr(ocr_engine, "_crop", _axis_crop)
+    engine = make_engine(workers=2, queue_size=8, timeout=5)
+    engine.batcher = ocr_engine.RecBatcher(engine, batch_size=64, max_wait_ms=200)
+
+    async def main():
+        return await asyncio.gather(
+            engine.recognize(_bands(10, 20, 30)),
+            engine.recognize(_bands(40)),
+            engine.recognize(_bands(50, 0, 60)),
+        )
+
+    assert asyncio.run(main()) == [["10", "20", "30"], ["40"], ["50", "60"]]
+    assert engine.batcher.batches == 1 and engine.batcher.crops == 7
+
+
+class _StuckEngine:
+    timeout = 0.3
+
+    async def submit(self, fn, *args, admitted=False):
+        await asyncio.sleep(60)
+
+
+def test_microbatch_waiters_resolved_when_batch_is_cancelled():
+    batcher = ocr_engine.RecBatcher(_StuckEngine(), batch_size=2, max_wait_ms=10)
+
+    async def main():
+        waiters = [asyncio.create_task(batcher.recognize([1])) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        for task in list(batcher._tasks):
+            task.cancel()
+        return await asyncio.gather(*waiters, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, OCRUnavailable) for r in results)
+
+
+def test_microbatch_recognize_times_out():
+    batcher = ocr_engine.RecBatcher(_StuckEngine(), batch_size=8, max_wait_ms=10)
+
+    async def main():
+        with pytest.raises(OCRTimeout):
+            await batcher.recognize([1])
+
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+import pytest
+
+from llm_client import SolutionCache
+from solve_stream import SolutionStreamParser, parse_solution
+
+SOLUTION = {
+    "problem": "解方程 x^2-3x+2=0",
+    "final_answer": "x = 1 或 x = 2",
+    "steps": [
+        {"step": "1", "content": "因式分解", "explain": "(x-1)(x-2)=0"},
+        {"step": "2", "content": "求解", "explain": '含 "引号" 和 {花括号}'},
+    ],
+    "why": "二次方程优先尝试因式分解",
+    "similar": ["x^2-5x+6=0"],
+}
+OUTPUT = json.dumps(SOLUTION, ensure_ascii=False, indent=2)
+
+
+def _feed(text, size):
+    parser = SolutionStreamParser()
+    events = []
+    for i in range(0, len(text), size):
+        events += parser.feed(text[i:i + size])
+    return events, parser.finish()
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 64, 10000])
+def test_events_independent_of_chunking(size):
+    events, result = _feed(OUTPUT, size)
+    assert [name for name, _ in events] == ["problem", "final_answer", "step", "step", "why", "similar"]
+    assert [value for name, value in events if name == "step"] == SOLUTION["steps"]
+    assert result == SOLUTION
+
+
+def test_ignores_fence_and_trailing_text():
+    _, result = _feed(f"好的，解答如下：\n```json\n{OUTPUT}\n```\n以上。{{不是 JSON}}", 5)
+    assert result == SOLUTION
+
+
+def test_truncated_output_keeps_completed_fields():
+    cut = OUTPUT.index('"why"') - 3
+    result = parse_solution(OUTPUT[:cut])
+    assert result["truncated"] is True
+    assert result["final_answer"] == SOLUTION["final_answer"]
+    assert result["steps"] == SOLUTION["steps"]
+    assert "why" not in result
+
+
+def test_no_json_raises():
+    with pytest.raises(ValueError):
+        parse_solution("抱歉，我无法回答。")
+
+
+def test_stream_claim_shares_inflight_result():
+    # 流式请求领头，后到的流式/非流式同题请求都合并到它的结果上
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {"never": "used"}
+
+    async def main():
+        cache = SolutionCache()
+        state, fut = cache.claim("k")
+        assert state == "lead"
+        waiter_state, waiter = cache.claim("k")
+        assert waiter_state == "wait" and waiter is fut
+        plain = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        fut.set_result(SOLUTION)
+        results = [await asyncio.shield(waiter), await plain]
+        hit_state, hit = cache.claim("k")
+        return cache, results, hit_state, hit
+
+    cache, results, hit_state, hit = asyncio.run(main())
+    assert results == [SOLUTION, SOLUTION] and not calls
+    assert (hit_state, hit) == ("hit", SOLUTION)
+    assert (cache.misses, cache.coalesced, cache.hits) == (1, 2, 1)
+
+
+def test_stream_claim_failure_not_cached():
+    async def main():
+        cache = SolutionCache()
+        _, fut = cache.claim("k")
+        fut.set_exception(ValueError("模型输出被截断"))
+        await asyncio.sleep(0)
+        return cache.claim("k")[0]
+
+    assert asyncio.run(main()) == "lead"
+
+
+class _SlowLLM:
+    async def stream_chat(self, prompt):
+        for i in range(0, len(OUTPUT), 20):
+            await asyncio.sleep(0.005)
+            yield OUTPUT[i:i + 20]
+
+
+def test_stream_leader_disconnect_does_not_fail_waiters(monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "llm", _SlowLLM())
+    monkeypatch.setattr(server, "solutions", SolutionCache())
+    req = server.SolveReq(problem="解方程 x^2-3x+2=0")
+
+    async def main():
+        leader = (await server.solve_stream(req)).body_iterator
+        first = await leader.__anext__()
+        # 同题的普通请求合并到领头的流上，随后领头的客户端断开
+        waiter = asyncio.create_task(server.solve(req))
+        await asyncio.sleep(0.01)
+        await leader.aclose()
+        return first, await asyncio.wait_for(waiter, 5)
+
+    first, result = asyncio.run(main())
+    assert first.startswith("event: problem")
+    assert result == SOLUTION
+    # 领头断开后上游仍读完，结果照常进缓存
+    assert server.solutions.claim((server.normalize_problem(req.problem), req.level)) == ("hit", SOLUTION)
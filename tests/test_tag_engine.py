@@ -0,0 +1,60 @@
+import pytest
+
+from tag_engine import AhoCorasick, TagEngine, normalize
+
+TAXONOMY = {
+    "fallback": "基础识别",
+    "min_score": 1.0,
+    "tags": [
+        {"tag": "函数", "keywords": {"函数": 1.0, "f(x)": 1.0}},
+        {"tag": "二次函数", "keywords": {"二次函数": 2.0, "x^2": 0.5}},
+        {"tag": "不等式", "keywords": {"不等式": 2.0}, "patterns": {"[0-9a-z)][<>][0-9a-z(-]": 1.0}},
+        {"tag": "数列", "keywords": {"数列": 1.0}, "patterns": {"a_?\\{?n[+-]1\\}?": 1.0}},
+    ],
+}
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return TagEngine(TAXONOMY)
+
+
+def test_normalize_fullwidth_superscript_and_space():
+    assert normalize("Ｆ（ｘ） = x² ＋ 1") == "f(x)=x^2+1"
+
+
+def test_aho_corasick_finds_overlapping_and_nested_words():
+    words = ["he", "she", "his", "hers"]
+    ac = AhoCorasick(words)
+    assert {words[i] for i in ac.find("ushers")} == {"he", "she", "hers"}
+    assert ac.find("xyz") == set()
+
+
+def test_keywords_accumulate_and_rank(engine):
+    scores = engine.score("已知二次函数 f(x)=x^2+1")
+    assert [s["tag"] for s in scores] == ["二次函数", "函数"]
+    assert scores[0]["score"] == 2.5
+
+
+def test_each_keyword_counts_once(engine):
+    assert engine.score("函数函数函数") == [{"tag": "函数", "score": 1.0}]
+
+
+def test_below_min_score_falls_back(engine):
+    assert engine.score("x^2") == []
+    assert engine.tag("x^2") == ["基础识别"]
+
+
+def test_overlapping_patterns_all_match(engine):
+    # "0<a" 与 "a_{n+1}" 共用字符 a，两个正则都要命中
+    assert {s["tag"] for s in engine.score("已知0<a_{n+1}")} == {"不等式", "数列"}
+
+
+def test_tag_many_matches_single(engine):
+    texts = ["解不等式 2x+1>3", "等差数列求和", ""]
+    assert engine.tag_many(texts) == [engine.score(t) for t in texts]
+
+
+def test_shipped_taxonomy_loads():
+    engine = TagEngine.load()
+    assert "导数-求导" in engine.tag("求函数 f(x)=x^3 的导数")
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from wrong_book import WrongBook
+
+
+@pytest.fixture
+def book(tmp_path):
+    book = WrongBook(str(tmp_path / "wrong_book.db"), commit_ms=5)
+    yield book
+    book.close()
+
+
+def _node_save(path, records):
+    # 与 server.js 的 /save_wrong 一样整文件改写
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+
+
+def test_no_connection_until_opened(tmp_path):
+    path = tmp_path / "lazy.db"
+    book = WrongBook(str(path))
+    assert not path.exists()
+    book.open()
+    assert path.exists()
+    book.close()
+
+
+def test_concurrent_adds_are_group_committed(book):
+    async def main():
+        return await asyncio.gather(*[
+            book.add({"question": f"q{i}", "student": "s1", "knowledge_tags": ["复数"]}) for i in range(500)])
+
+    ids = asyncio.run(main())
+    assert len(set(ids)) == 500
+    assert book.written == 500 and book.commits < 50
+
+
+def test_cursor_pagination_visits_each_entry_once(book):
+    async def main():
+        for i in range(45):
+            await book.add({"question": f"q{i}", "student": "s1" if i % 3 else "s2",
+                            "knowledge_tags": ["数列-等差"] if i % 2 else ["复数"],
+                            "time": f"2025-01-01T00:00:{i % 10:02d}.000Z"})
+
+    asyncio.run(main())
+    for student, tag, expected in [(None, None, 45), ("s1", None, 30), (None, "复数", 23), ("s2", "复数", 8)]:
+        seen, cursor = [], None
+        while True:
+            page = book.list(student, tag, limit=7, cursor=cursor)
+            seen += [(item["created"], item["id"]) for item in page["items"]]
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        assert len(seen) == len(set(seen)) == expected
+        assert seen == sorted(seen, reverse=True)
+
+
+def test_bad_cursor_raises_value_error(book):
+    with pytest.raises(ValueError):
+        book.list(cursor="not-a-cursor")
+
+
+def test_client_fields_do_not_override_columns(book, tmp_path):
+    path = tmp_path / "wrong_book.json"
+    _node_save(path, [{"id": "client-1", "student": "s1", "created": "x", "question": "q",
+                       "time": "2025-01-01T00:00:00.000Z"}])
+    book.import_json(str(path))
+    (item,) = book.list()["items"]
+    assert isinstance(item["id"], int)
+    assert item["record"]["id"] == "client-1"
+
+
+def test_reimport_after_node_rewrite_only_adds_new_records(book, tmp_path):
+    path = tmp_path / "wrong_book.json"
+    records = [
+        {"question": "q1", "knowledge_tags": ["复数"], "time": "2025-01-01T00:00:00.000Z"},
+        {"question": "q2", "knowledge_tags": ["复数", "数列-等差"], "time": "2025-01-01T00:00:01.000Z"},
+    ]
+    _node_save(path, records)
+    assert book.import_json(str(path)) == 2
+    assert book.import_json(str(path)) == 0
+
+    records.append({"question": "q3", "knowledge_tags": ["复数"], "time": "2025-01-02T00:00:00.000Z"})
+    _node_save(path, records)
+    os.utime(path, (1, 1))        # 确保 mtime 变化
+    assert book.import_json(str(path)) == 1
+
+    assert [item["record"]["question"] for item in book.list()["items"]] == ["q3", "q2", "q1"]
+    assert book.top_tags() == [{"tag": "复数", "count": 3}, {"tag": "数列-等差", "count": 1}]
+
+
+def test_top_tags_by_student_and_since(book):
+    async def main():
+        await book.add({"student": "a", "knowledge_tags": ["复数"], "time": 100.0})
+        await book.add({"student": "a", "knowledge_tags": ["复数", "概率统计"], "time": 200.0})
+        await book.add({"student": "b", "knowledge_tags": ["概率统计"], "time": 300.0})
+
+    asyncio.run(main())
+    assert book.top_tags("a") == [{"tag": "复数", "count": 2}, {"tag": "概率统计", "count": 1}]
+    assert book.top_tags(since=150) == [{"tag": "概率统计", "count": 2}, {"tag": "复数", "count": 1}]
+    assert book.top_tags(limit=1) == [{"tag": "复数", "count": 2}]
+
+
+def test_bad_record_fails_only_itself(book):
+    async def main():
+        return await asyncio.gather(
+            book.add({"question": "q1", "student": "s1", "knowledge_tags": "复数"}),
+            book.add({"question": "q2", "student": "s1", "knowledge_tags": 7}),
+            book.add({"question": "q3", "student": "s1", "extra": {1, 2}}),  # 无法序列化
+            book.add({"question": "q4", "student": "s1", "knowledge_tags": ["数列"]}),
+            return_exceptions=True,
+        )
+
+    ids = asyncio.run(main())
+    assert isinstance(ids[2], TypeError)
+    assert all(isinstance(i, int) for i in ids[:2] + ids[3:])
+    assert book.written == 3
+    assert {t["tag"] for t in book.top_tags("s1")} == {"复数", "数列"}
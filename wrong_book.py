@@ -0,0 +1,382 @@
+"""
+错题本：SQLite（WAL）存储，后台线程批量合并提交，按学生/时间/知识点建索引
+
+- 写入只追加，不再像 server.js 的 /save_wrong 那样整文件读出再重写
+- 列表按 (created, id) 游标分页，翻到多深都是索引查找
+- 旧的 wrong_book.json 启动时一次性批量导入；server.js 之后追加的记录在下次启动时补导，
+  已导入的记录按内容哈希去重
+- 连接在 open() 里建立（服务的 startup 阶段），不在 import 时打开，避免 fork 出的进程共用连接
+
+命令行导入：
+    python wrong_book.py import wrong_book.json [--db wrong_book.db]
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+WRONG_BOOK_DB = os.environ.get("WRONG_BOOK_DB", "wrong_book.db")
+WRONG_BOOK_IMPORT = os.environ.get("WRONG_BOOK_IMPORT", "wrong_book.json")
+WRONG_BOOK_BATCH = int(os.environ.get("WRONG_BOOK_BATCH", 256))
+WRONG_BOOK_COMMIT_MS = float(os.environ.get("WRONG_BOOK_COMMIT_MS", 5))
+WRONG_BOOK_QUEUE = int(os.environ.get("WRONG_BOOK_QUEUE", 10000))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS wrong_book (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    student  TEXT NOT NULL DEFAULT '',
+    created  REAL NOT NULL,
+    record   TEXT NOT NULL,
+    import_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_wrong_student_created ON wrong_book (student, created, id);
+CREATE INDEX IF NOT EXISTS idx_wrong_created ON wrong_book (created, id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_wrong_import_key ON wrong_book (import_key)
+    WHERE import_key IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS wrong_book_tags (
+    entry_id INTEGER NOT NULL REFERENCES wrong_book (id),
+    tag      TEXT NOT NULL,
+    student  TEXT NOT NULL DEFAULT '',
+    created  REAL NOT NULL,
+    PRIMARY KEY (tag, created, entry_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_tags_student ON wrong_book_tags (student, tag, created);
+
+CREATE TABLE IF NOT EXISTS wrong_book_imports (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime    REAL NOT NULL,
+    count    INTEGER NOT NULL,
+    imported REAL NOT NULL
+);
+"""
+
+
+class WrongBookFull(Exception):
+    """写入队列已满，调用方应返回 503"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL 下 NORMAL 只在断电时可能丢最后一批，进程崩溃不丢
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def _created(record):
+    value = record.get("time") or record.get("created")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+def _student(record):
+    return str(record.get("student") or record.get("student_id") or "")
+
+
+def _tags(record):
+    tags = record.get("knowledge_tags")
+    if tags is None and isinstance(record.get("parsed"), dict):
+        tags = record["parsed"].get("knowledge_tags")
+    # 旧数据里偶有单个字符串或其他类型，字符串整体当一个标签，其余忽略
+    if isinstance(tags, str):
+        tags = [tags]
+    elif not isinstance(tags, (list, tuple)):
+        tags = []
+    return list(dict.fromkeys(str(t) for t in tags))
+
+
+def _import_key(record):
+    """导入去重用：记录内容（含保存时间）的哈希，文件被改写、追加后重复导入也不会重复入库"""
+    canonical = json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def encode_cursor(created, entry_id):
+    return base64.urlsafe_b64encode(f"{created!r}:{entry_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    created, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+    return float(created), int(entry_id)
+
+
+class WrongBook:
+    def __init__(self, path: str = WRONG_BOOK_DB, batch: int = WRONG_BOOK_BATCH,
+                 commit_ms: float = WRONG_BOOK_COMMIT_MS, queue_size: int = WRONG_BOOK_QUEUE):
+        self.path = path
+        self.batch = batch
+        self.commit_wait = commit_ms / 1000
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._db = None
+        self._reader = None
+        self._open_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self.commits = 0
+        self.written = 0
+
+    def open(self):
+        """建表、打开读写连接、启动写线程；可重复调用"""
+        with self._open_lock:
+            if self._db is not None:
+                return
+            self._db = _connect(self.path)
+            self._db.executescript(_SCHEMA)
+            # 读走单独连接；WAL 下读写互不阻塞
+            self._reader = _connect(self.path)
+            self._writer = threading.Thread(target=self._write_loop, name="wrong-book-writer", daemon=True)
+            self._writer.start()
+
+    def close(self):
+        with self._open_lock:
+            if self._db is None:
+                return
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+            self._db.close()
+            self._reader.close()
+            self._db = self._reader = None
+
+    # ---------- 写入：合并提交 ----------
+    async def add(self, record: dict):
+        """追加一条错题，提交落盘后返回 id"""
+        self.open()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        try:
+            self._queue.put_nowait((record, loop, fut))
+        except queue.Full:
+            raise WrongBookFull("错题本写入繁忙，请稍后重试")
+        return await fut
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            pending = [item]
+            # 攒一小段时间或攒满一批再提交，一次 fsync 摊给整批
+            deadline = time.monotonic() + self.commit_wait
+            stop = False
+            while len(pending) < self.batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                pending.append(item)
+
+            self._commit(pending)
+            if stop:
+                return
+
+    def _commit(self, pending):
+        t0 = time.perf_counter()
+        try:
+            self._db.execute("BEGIN")
+            # 每条一个 SAVEPOINT：坏记录只回滚自己，同批其余照常提交
+            ids = []
+            for record, _, _ in pending:
+                self._db.execute("SAVEPOINT row")
+                try:
+                    ids.append(self._insert(record))
+                except Exception as e:
+                    self._db.execute("ROLLBACK TO row")
+                    metrics.error("wrong_book_insert", e)
+                    ids.append(e)
+                self._db.execute("RELEASE row")
+            self._db.execute("COMMIT")
+        except Exception as e:
+            self._db.execute("ROLLBACK")
+            metrics.error("wrong_book_commit", e)
+            for _, loop, fut in pending:
+                loop.call_soon_threadsafe(_settle, fut, None, e)
+            return
+
+        metrics.observe("wrong_book_commit", time.perf_counter() - t0)
+        self.commits += 1
+        for (_, loop, fut), entry_id in zip(pending, ids):
+            if isinstance(entry_id, Exception):
+                loop.call_soon_threadsafe(_settle, fut, None, entry_id)
+            else:
+                self.written += 1
+                loop.call_soon_threadsafe(_settle, fut, entry_id, None)
+
+    def _insert(self, record):
+        created = _created(record)
+        student = _student(record)
+        cur = self._db.execute(
+            "INSERT INTO wrong_book (student, created, record) VALUES (?, ?, ?)",
+            (student, created, json.dumps(record, ensure_ascii=False)),
+        )
+        entry_id = cur.lastrowid
+        self._db.executemany(
+            "INSERT OR IGNORE INTO wrong_book_tags (entry_id, tag, student, created) VALUES (?, ?, ?, ?)",
+            [(entry_id, tag, student, created) for tag in _tags(record)],
+        )
+        return entry_id
+
+    # ---------- 旧 JSON 批量导入 ----------
+    def import_json(self, path: str = WRONG_BOOK_IMPORT):
+        """
+        整文件一次事务导入，返回新入库条数。文件没变（路径、大小、修改时间相同）直接跳过；
+        变了则整文件再过一遍，已导入的记录由 import_key 唯一索引挡掉，只有新增记录入库。
+        """
+        if not path or not os.path.exists(path):
+            return 0
+        self.open()
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        rows = self._read("SELECT size, mtime FROM wrong_book_imports WHERE path = ?", (key,))
+        if rows and rows[0][0] == st.st_size and rows[0][1] == st.st_mtime:
+            return 0
+
+        with open(path, encoding="utf-8") as f:
+            records = json.load(f)
+        records = [r for r in records if isinstance(r, dict)]
+
+        # 单独的连接开写事务；写线程若同时在提交，busy_timeout 会让双方排队
+        conn = _connect(self.path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            tag_rows, added = [], 0
+            for r in records:
+                student, created = _student(r), _created(r)
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO wrong_book (student, created, record, import_key) VALUES (?, ?, ?, ?)",
+                    (student, created, json.dumps(r, ensure_ascii=False), _import_key(r)),
+                )
+                if cur.rowcount == 0:
+                    continue          # 之前已导入
+                added += 1
+                tag_rows += [(cur.lastrowid, tag, student, created) for tag in _tags(r)]
+            conn.executemany(
+                "INSERT OR IGNORE INTO wrong_book_tags (entry_id, tag, student, created) VALUES (?, ?, ?, ?)",
+                tag_rows,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO wrong_book_imports (path, size, mtime, count, imported) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, st.st_size, st.st_mtime, len(records), time.time()),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return added
+
+    # ---------- 查询 ----------
+    def _read(self, sql, params):
+        self.open()
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def list(self, student: str = None, tag: str = None, limit: int = 20, cursor: str = None):
+        """按时间倒序分页；cursor 为上一页返回的 next_cursor。客户端原始记录放在 record 里，
+        不与 id / student / created 混在一层，避免记录里的同名字段覆盖库里的值"""
+        limit = max(1, min(limit, 200))
+        where, params = [], []
+        if tag:
+            sql = ("SELECT w.id, w.student, w.created, w.record FROM wrong_book_tags t "
+                   "JOIN wrong_book w ON w.id = t.entry_id")
+            where.append("t.tag = ?")
+            params.append(tag)
+            col_created, col_id, col_student = "t.created", "t.entry_id", "t.student"
+        else:
+            sql = "SELECT w.id, w.student, w.created, w.record FROM wrong_book w"
+            col_created, col_id, col_student = "w.created", "w.id", "w.student"
+
+        if student is not None:
+            where.append(f"{col_student} = ?")
+            params.append(student)
+        if cursor:
+            created, entry_id = decode_cursor(cursor)
+            where.append(f"({col_created}, {col_id}) < (?, ?)")
+            params += [created, entry_id]
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {col_created} DESC, {col_id} DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._read(sql, params)
+        items = [{"id": r[0], "student": r[1], "created": r[2], "record": json.loads(r[3])}
+                 for r in rows[:limit]]
+        next_cursor = encode_cursor(rows[limit - 1][2], rows[limit - 1][0]) if len(rows) > limit else None
+        return {"items": items, "next_cursor": next_cursor}
+
+    def top_tags(self, student: str = None, since: float = None, limit: int = 10):
+        """错得最多的知识点"""
+        where, params = [], []
+        if student is not None:
+            where.append("student = ?")
+            params.append(student)
+        if since is not None:
+            where.append("created >= ?")
+            params.append(since)
+        sql = "SELECT tag, COUNT(*) AS n FROM wrong_book_tags"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " GROUP BY tag ORDER BY n DESC, tag LIMIT ?"
+        params.append(max(1, min(limit, 100)))
+        return [{"tag": tag, "count": n} for tag, n in self._read(sql, params)]
+
+    def stats(self):
+        return {
+            "queue": self._queue.qsize(),
+            "commits": self.commits,
+            "written": self.written,
+            "avg_batch": round(self.written / self.commits, 1) if self.commits else None,
+        }
+
+
+def _settle(fut, value, exc):
+    if fut.done():
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(value)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="错题本工具")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("import", help="把 wrong_book.json 导入 SQLite")
+    p.add_argument("path", nargs="?", default=WRONG_BOOK_IMPORT)
+    p.add_argument("--db", default=WRONG_BOOK_DB)
+    args = ap.parse_args()
+
+    book = WrongBook(args.db)
+    n = book.import_json(args.path)
+    book.close()
+    print(f"✔ 导入 {n} 条错题 → {args.db}" if n else f"⚠️ {args.path} 不存在或没有新记录")
+    sys.exit(0)